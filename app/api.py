@@ -3,15 +3,21 @@
 # ============================================================
 
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import Response, JSONResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from app.models import Turn, UserDetails
 from app.engine import DiagnosticEngine
 from app.report_generator import generate_report_pdf
 from app.facilities_service import FacilitiesService
+from app.response_cache import ResponseCache, SEMANTIC_CACHE_ENABLED
+from functools import lru_cache
+import asyncio
 import datetime
-import traceback
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 # ============================================================
 # Pydantic Models for API Requests/Responses
@@ -43,7 +49,7 @@ class GetNearestFacilitiesRequest(BaseModel):
     facility_type: str = "all"
 
 class ExtractSpecialistRequest(BaseModel):
-    chat_history: List[dict]
+    chat_history: List[Turn]
 
 # ============================================================
 # Initialize Router and Diagnostic Engine
@@ -51,13 +57,38 @@ class ExtractSpecialistRequest(BaseModel):
 
 router = APIRouter()
 
-try:
-    engine = DiagnosticEngine()
-    chain = engine.get_chain()
-except Exception as e:
-    # Fatal error during engine initialization
-    print(f"FATAL: Failed to initialize DiagnosticEngine: {e}")
-    raise RuntimeError(f"Engine initialization failed: {e}") from e
+# The engine is built lazily (once per worker process, at server startup) rather
+# than at import, so importing this module — e.g. in the uvicorn reloader or a
+# multi-worker parent process — does not load the retriever and LLM client.
+
+@lru_cache(maxsize=1)
+def get_engine() -> DiagnosticEngine:
+    """
+    Return the process-wide DiagnosticEngine, creating it on first use.
+    """
+    try:
+        return DiagnosticEngine()
+    except Exception as e:
+        # Fatal error during engine initialization
+        logger.critical("FATAL: Failed to initialize DiagnosticEngine: %s", e)
+        raise RuntimeError(f"Engine initialization failed: {e}") from e
+
+@lru_cache(maxsize=1)
+def get_chain():
+    """
+    Return the diagnostic LCEL chain built from the shared engine.
+    """
+    return get_engine().get_chain()
+
+@lru_cache(maxsize=1)
+def get_response_cache() -> ResponseCache:
+    """
+    Response cache for /chat. Exact repeats only, unless MEDSAGE_SEMANTIC_CACHE=1
+    enables semantic lookups using the retriever's embedding model.
+    """
+    if not SEMANTIC_CACHE_ENABLED:
+        return ResponseCache()
+    return ResponseCache(embed_fn=get_engine().retriever.embedding_model.embed_query)
 
 # ============================================================
 # Endpoint: Extract Specialist from Chat History
@@ -77,25 +108,24 @@ async def extract_specialist(request: ExtractSpecialistRequest):
           ]
       }
     """
-    print(f"[API /extract_specialist] Extracting specialist from {len(request.chat_history)} messages")
+    logger.info("[API /extract_specialist] Extracting specialist from %d messages", len(request.chat_history))
     try:
         specialist = FacilitiesService.extract_specialist_from_chat(request.chat_history)
         if specialist:
-            print(f"[API /extract_specialist] Found specialist: {specialist}")
+            logger.info("[API /extract_specialist] Found specialist: %s", specialist)
             return {
                 "success": True,
                 "specialist": specialist
             }
         else:
-            print(f"[API /extract_specialist] No specialist found in chat")
+            logger.info("[API /extract_specialist] No specialist found in chat")
             return {
                 "success": True,
                 "specialist": "",
                 "message": "No specialist found in chat history"
             }
     except Exception as e:
-        print(f"Error in /extract_specialist endpoint: {e}")
-        traceback.print_exc()
+        logger.exception("Error in /extract_specialist endpoint: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # ============================================================
@@ -111,14 +141,14 @@ async def patient_info(request: PatientInfo):
     First step before diagnosis begins.
     """
     try:
-        print(f"[API /patient] Received: {request.dict()}")
-        return JSONResponse(content={
+        data = request.model_dump()
+        logger.info("[API /patient] Received: %s", data)
+        return ORJSONResponse(content={
             "message": "Patient info received successfully.",
-            "data": request.dict()
+            "data": data
         })
     except Exception as e:
-        print(f"Error in /patient endpoint: {e}")
-        traceback.print_exc()
+        logger.exception("Error in /patient endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to process patient info: {e}")
 
 # ============================================================
@@ -127,33 +157,98 @@ async def patient_info(request: PatientInfo):
 # Method: POST
 # ============================================================
 
+def _sse(event: dict) -> str:
+    """
+    Format one event as a Server-Sent Events message.
+    """
+    return f"data: {json.dumps(event)}\n\n"
+
+async def _finish_turn(request: ChatRequest, history: List[Turn], history_dump: List[dict],
+                       chain_output: dict, cached: Optional[dict]) -> ChatResponse:
+    """
+    Shared end of a chat turn (streamed or not): store a freshly generated, non-empty
+    output in the response cache and build the ChatResponse, with the AI reply filled
+    into the last history turn.
+    """
+    generated = chain_output.get("ai_response")
+    ai_response = generated or "Error: No response generated."
+    search_query = chain_output.get("search_query", "N/A")
+    retrieved_context = chain_output.get("retrieved_context", "N/A")
+    # Missing or blank outputs are not cached, so a transient LLM failure is not replayed until the TTL expires
+    if cached is None and isinstance(generated, str) and generated.strip():
+        await get_response_cache().aset(history_dump, request.query, {
+            "ai_response": ai_response,
+            "search_query": search_query,
+            "retrieved_context": retrieved_context
+        })
+    history[-1] = history[-1].model_copy(update={"ai": ai_response})
+    return ChatResponse(
+        ai_response=ai_response,
+        history=history,
+        search_query=search_query,
+        retrieved_context=retrieved_context
+    )
+
+async def _stream_chat(request: ChatRequest, history_dump: List[dict], cached: Optional[dict]):
+    """
+    Yields the AI response as SSE token events, followed by a terminal "done"
+    event carrying the full ChatResponse (including the updated history).
+    """
+    try:
+        # One list serves as chain input and, with its last turn replaced, as the response history
+        history = [*request.history, Turn(human=request.query, ai="")]
+        if cached is not None:
+            chain_output = cached
+            yield _sse({"type": "token", "content": cached["ai_response"]})
+        else:
+            input_data = {"history": history}
+            chain_output = {}
+            async for event in get_engine().astream_chat(input_data):
+                if event["type"] == "token":
+                    yield _sse(event)
+                else:
+                    chain_output = event
+        response = await _finish_turn(request, history, history_dump, chain_output, cached)
+        logger.debug("[API /chat] Streamed response: '%s...'", response.ai_response[:60])
+        yield _sse({"type": "done", **response.model_dump(mode="json")})
+    except Exception as e:
+        # Headers are already sent, so report the failure as a terminal event
+        logger.exception("Error in /chat stream: %s", e)
+        yield _sse({"type": "error", "detail": f"Internal Server Error processing chat: {e}"})
+
 @router.post("/chat",
              response_model=ChatResponse,
+             response_class=ORJSONResponse,
              summary="Process one turn of the diagnostic chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, stream: bool = True):
     """
     Handles one turn of the diagnostic chat between patient and AI.
+    By default the response is streamed as Server-Sent Events ("token" events,
+    then a final "done" event with the ChatResponse). Pass ?stream=false to get
+    a single JSON ChatResponse instead.
     """
-    print(f"[API /chat] Received query: '{request.query}' with history length: {len(request.history)}")
+    logger.debug("[API /chat] Received query: '%s' with history length: %d, stream=%s",
+                 request.query, len(request.history), stream)
     try:
-        current_turn_input = Turn(human=request.query, ai="")
-        input_data = {"history": request.history + [current_turn_input]}
-        chain_output = await chain.ainvoke(input_data)
-        ai_response = chain_output.get("ai_response", "Error: No response generated.")
-        search_query = chain_output.get("search_query", "N/A")
-        retrieved_context = chain_output.get("retrieved_context", "N/A")
-        final_turn = Turn(human=request.query, ai=ai_response)
-        updated_history = request.history + [final_turn]
-        print(f"[API /chat] Sending response: '{ai_response[:60]}...'")
-        return ChatResponse(
-            ai_response=ai_response,
-            history=updated_history,
-            search_query=search_query,
-            retrieved_context=retrieved_context
-        )
+        history_dump = [turn.model_dump(mode="json") for turn in request.history]
+        cached = await get_response_cache().aget(history_dump, request.query)
+        if stream:
+            return StreamingResponse(
+                _stream_chat(request, history_dump, cached),
+                media_type="text/event-stream"
+            )
+        # One list serves as chain input and, with its last turn replaced, as the response history
+        history = [*request.history, Turn(human=request.query, ai="")]
+        if cached is not None:
+            chain_output = cached
+        else:
+            input_data = {"history": history}
+            chain_output = await get_chain().ainvoke(input_data)
+        response = await _finish_turn(request, history, history_dump, chain_output, cached)
+        logger.debug("[API /chat] Sending response: '%s...'", response.ai_response[:60])
+        return response
     except Exception as e:
-        print(f"Error in /chat endpoint: {e}")
-        traceback.print_exc()
+        logger.exception("Error in /chat endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"Internal Server Error processing chat: {e}")
 
 # ============================================================
@@ -162,6 +257,16 @@ async def chat(request: ChatRequest):
 # Method: POST
 # ============================================================
 
+PDF_STREAM_CHUNK_SIZE = 64 * 1024  # Bytes per chunk when streaming the PDF
+
+def _iter_chunks(data):
+    """
+    Yield zero-copy memoryview slices of a bytes-like object.
+    """
+    view = memoryview(data)
+    for start in range(0, len(view), PDF_STREAM_CHUNK_SIZE):
+        yield view[start:start + PDF_STREAM_CHUNK_SIZE]
+
 @router.post("/generate_report",
              summary="Generate a PDF summary of the chat session",
              responses={
@@ -174,23 +279,25 @@ async def generate_report(request: ReportRequest):
     Generates a PDF report summarizing patient info and chat history.
     Uses LLM to create a clinical summary.
     """
-    print(f"[API /generate_report] Received request. History length: {len(request.chat_history)}")
+    logger.info("[API /generate_report] Received request. History length: %d", len(request.chat_history))
     try:
-        pdf_bytes = generate_report_pdf(request.user_details, request.chat_history)
-        print(f"[API /generate_report] PDF generated, size: {len(pdf_bytes)} bytes.")
-        return Response(
-            content=bytes(pdf_bytes),
+        # Blocking LLM call + PDF rendering: run in a worker thread so /chat streams keep flowing
+        pdf_bytes = await asyncio.to_thread(generate_report_pdf, request.user_details, request.chat_history)
+        logger.info("[API /generate_report] PDF generated, size: %d bytes.", len(pdf_bytes))
+        # Stream the rendered buffer in chunks instead of copying it into a new bytes object
+        return StreamingResponse(
+            _iter_chunks(pdf_bytes),
             media_type="application/pdf",
             headers={
+                "Content-Length": str(len(pdf_bytes)),
                 "Content-Disposition": f"attachment; filename=MedSage_Report_{datetime.date.today().strftime('%Y%m%d')}.pdf"
             }
         )
     except ValueError as ve:
-        print(f"Value Error generating report: {ve}")
+        logger.warning("Value Error generating report: %s", ve)
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
-        print(f"Error in /generate_report endpoint: {e}")
-        traceback.print_exc()
+        logger.exception("Error in /generate_report endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to generate PDF report: {e}")
 
 # ============================================================
@@ -212,7 +319,8 @@ async def get_nearest_facilities(request: GetNearestFacilitiesRequest):
           "facility_type": "hospital"
       }
     """
-    print(f"[API /get_nearest_facilities] Pincode: {request.pincode}, Specialist: {request.specialist}, Type: {request.facility_type}")
+    logger.info("[API /get_nearest_facilities] Pincode: %s, Specialist: %s, Type: %s",
+                request.pincode, request.specialist, request.facility_type)
     try:
         result = FacilitiesService.get_nearest_facility_links(
             pincode=request.pincode,
@@ -224,13 +332,12 @@ async def get_nearest_facilities(request: GetNearestFacilitiesRequest):
                 status_code=400,
                 detail=result.get("error", "Failed to fetch facilities")
             )
-        print(f"[API /get_nearest_facilities] Generated links for pincode: {result['pincode']}")
+        logger.info("[API /get_nearest_facilities] Generated links for pincode: %s", result['pincode'])
         return result
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error in /get_nearest_facilities endpoint: {e}")
-        traceback.print_exc()
+        logger.exception("Error in /get_nearest_facilities endpoint: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # ============================================================
@@ -245,14 +352,13 @@ async def available_pincodes():
     """
     Returns list of available pincodes for facility search.
     """
-    print("[API /available_pincodes] Request received")
+    logger.info("[API /available_pincodes] Request received")
     try:
         return {
             # Potentially list pincodes here
         }
     except Exception as e:
-        print(f"Error in /available_pincodes endpoint: {e}")
-        traceback.print_exc()
+        logger.exception("Error in /available_pincodes endpoint: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # ============================================================
@@ -5,10 +5,49 @@
 from rag_system.retriever import AdvancedRetriever
 from app.nim_client import get_nim_llm
 from app import prompts
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda, RunnableBranch
+from langchain_core.runnables import RunnableLambda
 from langchain_core.output_parsers import StrOutputParser
+import asyncio
+import logging
 import re  # Import regex for simple rule-based checks
 
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# Rule-Based Classification Constants
+# Compiled once at import so every turn reuses them
+# ============================================================
+
+SIMPLE_ANSWER_PATTERN = re.compile(
+    r"^(yes|no|yeah|nope|yep|nah|i don'?t know|maybe|sometimes|rarely|often)\b[\.,!?]?\s*$",
+    re.IGNORECASE
+)
+TOKEN_PATTERN = re.compile(r"[a-z']+")
+
+# Words that almost always introduce a new symptom or diagnostic detail
+NEW_INFO_MARKERS = frozenset({
+    "pain", "ache", "aches", "hurts", "hurt", "fever", "cough", "vomiting", "nausea",
+    "rash", "swelling", "swollen", "bleeding", "blood", "dizzy", "dizziness", "headache",
+    "itching", "itchy", "numb", "numbness", "tingling", "breathless", "shortness",
+    "diarrhea", "constipation", "fatigue", "tired", "weakness", "chills", "sweating",
+    "since", "started", "days", "weeks", "months", "worse", "worsening", "also", "new",
+    # Medications and medical history
+    "took", "taking", "medication", "medicine", "pills", "tablets", "diagnosed",
+    "diabetes", "asthma", "allergic", "allergy", "pregnant", "surgery",
+})
+
+# Words typical of a direct reply to the previous question
+ANSWER_MARKERS = frozenset({
+    "yes", "no", "yeah", "yep", "nope", "nah", "maybe", "sometimes", "rarely", "often",
+    "never", "always", "not", "sure", "don't", "dont", "know", "i", "it", "a", "little",
+    "bit", "mild", "moderate", "severe", "ok", "okay", "right", "correct", "true",
+    "really", "at", "all",
+})
+
+FAST_PATH_MAX_TOKENS = 5  # Only very short messages (in words) are classified as answers by rule
+
+KEEPALIVE_INTERVAL_SECONDS = 240  # Ping the LLM endpoint before idle connections are recycled
+
 # ============================================================
 # DiagnosticEngine Class
 # Main class for handling diagnostic logic and LCEL chain creation
@@ -19,65 +58,115 @@ class DiagnosticEngine:
         """
         Initialize the DiagnosticEngine with LLM, classifier, and retriever.
         """
-        print("Initializing Diagnostic Engine...")
+        logger.info("Initializing Diagnostic Engine...")
         self.llm = get_nim_llm()  # Main LLM for diagnosis
         # Optional: Use a smaller/faster LLM for classification if needed
         self.classifier_llm = self.llm  # Using the same LLM for now
         self.retriever = AdvancedRetriever()
-        print("Engine initialized. Ready for requests.")
+        # LCEL chains: preparation (classify + retrieve + format history), generation, and the full chain
+        self._prepare_chain, self._generation_chain, self._chain = self._build_chains()
+        logger.info("Engine initialized. Ready for requests.")
+
+    # ============================================================
+    # Warmup & Keepalive
+    # ============================================================
+
+    async def warmup(self):
+        """
+        Pay cold-start costs before the first user request: page the retriever
+        indexes/models into memory and open the connection to the LLM endpoint
+        with a 1-token request.
+        """
+        logger.info("Warming up retriever and LLM...")
+        await self.retriever.asearch("warmup")
+        await self.llm.bind(max_tokens=1).ainvoke("ping")
+        logger.info("Warmup complete.")
+
+    async def keepalive(self):
+        """
+        Periodically send a 1-token request so the LLM connection stays open
+        while the server is idle. Runs until cancelled.
+        """
+        while True:
+            await asyncio.sleep(KEEPALIVE_INTERVAL_SECONDS)
+            try:
+                await self.llm.bind(max_tokens=1).ainvoke("ping")
+                logger.debug("LLM keepalive ping sent.")
+            except Exception as e:
+                logger.warning("LLM keepalive ping failed: %s", e)
 
     # ============================================================
     # Helper Methods
     # ============================================================
 
+    @staticmethod
+    def _format_turn(turn) -> str:
+        """
+        Format a single chat turn; the AI line is omitted while it is still empty.
+        """
+        if turn.ai:
+            return f"User: {turn.human}\nAI: {turn.ai}\n"
+        return f"User: {turn.human}\n"
+
     def _format_history(self, chat_history: list) -> str:
         """
         Format chat history into a readable string for LLM context.
         """
         if not chat_history:
             return "No history yet."
-        formatted_history = ""
-        for turn in chat_history:
-            formatted_history += f"User: {turn.human}\n"
-            # Make sure the AI response exists before adding (important for current turn)
-            if turn.ai:
-                formatted_history += f"AI: {turn.ai}\n"
-        return formatted_history.strip()
+        return "".join(self._format_turn(turn) for turn in chat_history).strip()
+
+    def _fast_classify(self, message: str) -> str | None:
+        """
+        Classify a user message with cheap rules only.
+        Returns ANSWER_ONLY / NEW_INFO, or None when the rules are inconclusive.
+        """
+        text = message.strip()
+        if not text:
+            return "ANSWER_ONLY"
+        if SIMPLE_ANSWER_PATTERN.match(text):
+            return "ANSWER_ONLY"
+
+        words = TOKEN_PATTERN.findall(text.lower())
+        tokens = set(words)
+        # Checked first, so a symptom word is never hidden behind a leading "no"/"not"
+        if tokens & NEW_INFO_MARKERS:
+            return "NEW_INFO"
+        # Short single-clause replies made only of answer words (e.g. "not really",
+        # "a little bit"); a comma clause may add something new, so it goes to the LLM
+        if len(words) <= FAST_PATH_MAX_TOKENS and tokens <= ANSWER_MARKERS and "," not in text:
+            return "ANSWER_ONLY"
+        # Long free-text descriptions nearly always carry new details
+        if len(words) > 3 * FAST_PATH_MAX_TOKENS:
+            return "NEW_INFO"
+        return None
 
-    def _classify_input(self, input_dict: dict) -> str:
+    async def _allm_classify(self, input_dict: dict) -> str:
         """
-        Classify user input as ANSWER_ONLY or NEW_INFO.
-        Uses rule-based checks first, then falls back to LLM classification.
+        Classify user input as ANSWER_ONLY or NEW_INFO with the LLM.
+        Only called when the rule-based `_fast_classify` is inconclusive.
         """
         history = input_dict["history"]
         last_user_message = history[-1].human
         last_ai_question = history[-2].ai if len(history) > 1 else ""  # Get previous AI question
 
-        # --- 1. Rule-Based Check for simple answers ---
-        simple_answer_pattern = r"^(yes|no|yeah|nope|yep|nah|i don'?t know|maybe|sometimes|rarely|often)\b[\.,!?]?\s*$"
-        # Check if the message is short and matches simple patterns
-        if len(last_user_message.split()) <= 5 and re.match(simple_answer_pattern, last_user_message, re.IGNORECASE):
-            print("[DEBUG] Classified as ANSWER_ONLY (Rule-Based)")
-            return "ANSWER_ONLY"
-
-        # --- 2. LLM Classification (if rule doesn't match) ---
-        print("[DEBUG] Performing LLM Classification...")
+        logger.debug("Performing LLM Classification...")
         classification_chain = (
             prompts.CLASSIFICATION_PROMPT
             | self.classifier_llm  # Use the dedicated classifier LLM if defined
             | StrOutputParser()
         )
-        classification_result = classification_chain.invoke({
+        classification_result = (await classification_chain.ainvoke({
             "last_ai_question": last_ai_question,
             "user_input": last_user_message
-        }).strip().upper()  # Ensure consistent format
+        })).strip().upper()  # Ensure consistent format
 
         # Basic validation of LLM output
         if classification_result not in ["NEW_INFO", "ANSWER_ONLY"]:
-            print(f"[WARN] LLM Classifier returned unexpected value: '{classification_result}'. Defaulting to NEW_INFO.")
+            logger.warning("LLM Classifier returned unexpected value: '%s'. Defaulting to NEW_INFO.", classification_result)
             classification_result = "NEW_INFO"  # Default to retrieving if unsure
 
-        print(f"[DEBUG] Classified as {classification_result} (LLM)")
+        logger.debug("Classified as %s (LLM)", classification_result)
         return classification_result
 
     # ============================================================
@@ -87,48 +176,66 @@ class DiagnosticEngine:
 
     def get_chain(self):
         """
-        Creates the main LCEL chain with conditional retrieval.
+        Return the main LCEL chain with conditional retrieval (built once in __init__).
+        """
+        return self._chain
+
+    def _build_chains(self):
+        """
+        Build the LCEL chains used by get_chain and astream_chat.
+
+        Returns:
+            (prepare_chain, generation_chain, full_chain): preparation steps
+            (classification, retrieval, history formatting), the prompt | LLM
+            generation chain, and the full chain producing the final outputs.
         """
         # --- Helper functions ---
         def extract_last_query(input_dict: dict) -> str:
             return input_dict["history"][-1].human
 
-        def get_context(search_query: str) -> str:
-            print(f"[DEBUG] Retrieving context for query: '{search_query}'")
-            context = self.retriever.search(search_query)
-            print(f"[DEBUG] Retrieved context length: {len(context)}")
+        async def get_context(search_query: str) -> str:
+            logger.debug("Retrieving context for query: '%s'", search_query)
+            context = await self.retriever.asearch(search_query)
+            logger.debug("Retrieved context length: %d", len(context))
             return context
 
         def should_retrieve(classification_result: str) -> bool:
             retrieve = classification_result == "NEW_INFO"
-            print(f"[DEBUG] Should retrieve context? {retrieve}")
+            logger.debug("Should retrieve context? %s", retrieve)
             return retrieve
 
         # --- Define Chain Steps ---
 
-        # Step 1: Classify the latest user input
-        classification_chain = RunnableLambda(self._classify_input)
-
-        # Step 2: Define the RAG path (Retrieve context)
-        rag_chain_with_context = RunnablePassthrough.assign(
-            search_query=RunnableLambda(extract_last_query),  # Use direct query now
-        ).assign(
-            context=lambda x: get_context(x['search_query'])
-        )
+        # Steps 1-4: Classify the latest user input and retrieve context concurrently
+        async def classify_and_retrieve(input_dict: dict) -> dict:
+            search_query = extract_last_query(input_dict)
 
-        # Step 3: Define the Non-RAG path (No context retrieval)
-        chain_without_context = RunnablePassthrough.assign(
-            search_query=RunnableLambda(extract_last_query),  # Still log the query used
-            context=lambda x: "[CONTEXT SKIPPED]"  # Indicate context wasn't retrieved
-        )
+            # Rules settle most inputs instantly; only start retrieval if it is needed
+            classification = self._fast_classify(search_query)
+            if classification is not None:
+                logger.debug("Classified as %s (Rule-Based)", classification)
+                context = await get_context(search_query) if should_retrieve(classification) else None
+            else:
+                # LLM classification needed: retrieve speculatively so its latency
+                # hides behind the classifier call, and drop it if not needed
+                retrieval_task = asyncio.create_task(get_context(search_query))
+                try:
+                    classification = await self._allm_classify(input_dict)
+                except Exception:
+                    retrieval_task.cancel()
+                    raise
+                if should_retrieve(classification):
+                    context = await retrieval_task
+                else:
+                    retrieval_task.cancel()
+                    context = None
 
-        # Step 4: Branch based on classification
-        conditional_retrieval_chain = RunnableBranch(
-            # Condition: If classification is NEW_INFO, run the RAG chain
-            (lambda x: should_retrieve(x['classification']), rag_chain_with_context),
-            # Default: Otherwise, run the chain without context
-            chain_without_context
-        )
+            return {
+                **input_dict,
+                "classification": classification,
+                "search_query": search_query,
+                "context": context if context is not None else "[CONTEXT SKIPPED]"
+            }
 
         # Step 5: Final Generation Chain
         generation_chain = (
@@ -137,17 +244,19 @@ class DiagnosticEngine:
             | StrOutputParser()
         )
 
+        async def generate_response(input_dict: dict) -> str:
+            return await generation_chain.ainvoke(
+                {"context": input_dict['context'], "history": input_dict['history_formatted']}
+            )
+
         # --- Combine steps ---
-        full_chain = RunnablePassthrough.assign(
-            classification=classification_chain  # Run classification first
-        ).pipe(  # Pipe the result (including classification) to the branch
-            conditional_retrieval_chain
-        ).assign(  # Now add history formatting and run the final generation
+        prepare_chain = RunnableLambda(
+            classify_and_retrieve  # Classification + context retrieval
+        ).assign(  # Now add history formatting for the final generation
             history_formatted=lambda x: self._format_history(x['history'])
-        ).assign(
-            ai_response=lambda x: generation_chain.invoke(
-                {"context": x['context'], "history": x['history_formatted']}
-            )
+        )
+        full_chain = prepare_chain.assign(
+            ai_response=RunnableLambda(generate_response)  # Awaited, never blocks the event loop
         )
 
         # Select final outputs
@@ -157,4 +266,31 @@ class DiagnosticEngine:
             "retrieved_context": x.get('context', 'ERROR: context not found')
         })
 
-        return output_chain
+        return prepare_chain, generation_chain, output_chain
+
+    # ============================================================
+    # Streaming Generation
+    # Same steps as get_chain, but yields response tokens as they arrive
+    # ============================================================
+
+    async def astream_chat(self, input_data: dict):
+        """
+        Run one chat turn and stream the AI response.
+
+        Yields {"type": "token", "content": ...} events while generating, then a
+        final {"type": "result", ...} event with the same keys as the chain output.
+        """
+        prepared = await self._prepare_chain.ainvoke(input_data)
+        response_parts = []
+        async for token in self._generation_chain.astream(
+            {"context": prepared['context'], "history": prepared['history_formatted']}
+        ):
+            response_parts.append(token)
+            yield {"type": "token", "content": token}
+
+        yield {
+            "type": "result",
+            "ai_response": "".join(response_parts),
+            "search_query": prepared.get('search_query', 'ERROR: search_query not found'),
+            "retrieved_context": prepared.get('context', 'ERROR: context not found')
+        }
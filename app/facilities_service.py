@@ -1,6 +1,9 @@
 # app/facilities_service.py
+import re
+from functools import lru_cache
 from typing import Dict, List
 from urllib.parse import quote
+from app.models import Turn
 
 
 class FacilitiesService:
@@ -22,43 +25,58 @@ class FacilitiesService:
         "Gynecologist": "gynecologist",
     }
 
+    # (pattern, specialist) pairs in priority order, matched case-insensitively
+    SPECIALIST_PATTERNS = [
+        ("primary care physician or cardiologist", "Cardiologist"),
+        ("primary care physician", "General Practitioner"),
+        ("cardiologist", "Cardiologist"),
+        ("neurologist", "Neurologist"),
+        ("pulmonologist", "Pulmonologist"),
+        ("gastroenterologist", "Gastroenterologist"),
+        ("orthopedic surgeon", "Orthopedic Surgeon"),
+        ("dermatologist", "Dermatologist"),
+        ("ophthalmologist", "Ophthalmologist"),
+        ("ent specialist", "ENT Specialist"),
+        ("otolaryngologist", "ENT Specialist"),
+        ("pediatrician", "Pediatrician"),
+        ("psychiatrist", "Psychiatrist"),
+        ("urologist", "Urologist"),
+        ("gynecologist", "Gynecologist"),
+    ]
+
+    # Compiled once at class load: one alternation scans a message in a single pass
+    SPECIALIST_PATTERN_RE = re.compile(
+        "|".join(re.escape(p) for p, _ in SPECIALIST_PATTERNS), re.IGNORECASE
+    )
+    RECOMMEND_RE = re.compile("recommend", re.IGNORECASE)
+    SPECIALIST_PRIORITY = {p: i for i, (p, _) in enumerate(SPECIALIST_PATTERNS)}
+    SPECIALIST_BY_PATTERN = dict(SPECIALIST_PATTERNS)
+
+    # Exactly six ASCII digits, checked in one compiled pass
+    PINCODE_MATCH = re.compile(r"[0-9]{6}").fullmatch
+
     @staticmethod
-    def extract_specialist_from_chat(chat_history: List[dict]) -> str:
+    def extract_specialist_from_chat(chat_history: List[Turn]) -> str:
         """
         Extract recommended specialist from chat history
         
         Args:
-            chat_history: List of chat messages with 'human' and 'ai' keys
+            chat_history: List of chat turns with 'human' and 'ai' messages
         
         Returns:
             Specialist name if found, empty string otherwise
         """
-        specialist_patterns = [
-            ("primary care physician or cardiologist", "Cardiologist"),
-            ("primary care physician", "General Practitioner"),
-            ("cardiologist", "Cardiologist"),
-            ("neurologist", "Neurologist"),
-            ("pulmonologist", "Pulmonologist"),
-            ("gastroenterologist", "Gastroenterologist"),
-            ("orthopedic surgeon", "Orthopedic Surgeon"),
-            ("dermatologist", "Dermatologist"),
-            ("ophthalmologist", "Ophthalmologist"),
-            ("ent specialist", "ENT Specialist"),
-            ("otolaryngologist", "ENT Specialist"),
-            ("pediatrician", "Pediatrician"),
-            ("psychiatrist", "Psychiatrist"),
-            ("urologist", "Urologist"),
-            ("gynecologist", "Gynecologist"),
-        ]
-
-        for message in chat_history:
-            if message.get("ai"):
-                ai_text = message["ai"].lower()
-                
-                if "recommended specialist" in ai_text or "recommend" in ai_text:
-                    for pattern, specialist in specialist_patterns:
-                        if pattern in ai_text:
-                            return specialist
+        # The recommendation almost always sits in the latest AI message, so scan
+        # newest-first; case-insensitive regexes avoid lowercasing every message
+        for message in reversed(chat_history):
+            ai_text = message.ai
+            if ai_text and FacilitiesService.RECOMMEND_RE.search(ai_text):
+                # Single pass over the message; the earliest pattern in
+                # SPECIALIST_PATTERNS wins when several are mentioned
+                matches = FacilitiesService.SPECIALIST_PATTERN_RE.findall(ai_text)
+                if matches:
+                    best = min((m.lower() for m in matches), key=FacilitiesService.SPECIALIST_PRIORITY.__getitem__)
+                    return FacilitiesService.SPECIALIST_BY_PATTERN[best]
         
         return ""
 
@@ -69,7 +87,7 @@ class FacilitiesService:
         facility_type: str = "all"
     ) -> Dict:
         
-        if not pincode or len(pincode) != 6 or not pincode.isdigit():
+        if not pincode or not FacilitiesService.PINCODE_MATCH(pincode):
             return {
                 "success": False,
                 "error": "Invalid pincode. Must be exactly 6 digits."
@@ -94,46 +112,57 @@ class FacilitiesService:
         pincode: str
     ) -> Dict:
         
-        specialist_keyword = FacilitiesService.SPECIALIST_KEYWORDS.get(
-            specialist,
-            specialist or "hospital"
-        )
+        # Memoized: repeated (specialist, facility_type, pincode) lookups reuse the links
+        return _cached_search_links(specialist, facility_type, pincode)
 
-        facility_searches = {
-            "all": {
-                "nearest_hospitals": f"nearest {specialist_keyword} hospital in {pincode}",
-                "nearest_clinics": f"nearest {specialist_keyword} clinic in {pincode}",
-                "nearest_nursing": f"nearest nursing home in {pincode}"
-            },
-            "hospital": {
-                "nearest_hospitals": f"nearest {specialist_keyword} hospital in {pincode}"
-            },
-            "clinic": {
-                "nearest_clinics": f"nearest {specialist_keyword} clinic in {pincode}"
-            },
-            "nursing": {
-                "nearest_nursing": f"nearest nursing home in {pincode}"
-            }
-        }
 
-        searches = facility_searches.get(facility_type, facility_searches["all"])
-        
-        links = {}
-        facility_names = {
-            "nearest_hospitals": "🏥 Nearest Hospitals",
-            "nearest_clinics": "🏢 Nearest Clinics",
-            "nearest_nursing": "🏘️ Nearest Nursing Homes"
+# Search query templates per facility type, built once at import
+FACILITY_SEARCH_TEMPLATES = {
+    "all": {
+        "nearest_hospitals": "nearest {keyword} hospital in {pincode}",
+        "nearest_clinics": "nearest {keyword} clinic in {pincode}",
+        "nearest_nursing": "nearest nursing home in {pincode}"
+    },
+    "hospital": {
+        "nearest_hospitals": "nearest {keyword} hospital in {pincode}"
+    },
+    "clinic": {
+        "nearest_clinics": "nearest {keyword} clinic in {pincode}"
+    },
+    "nursing": {
+        "nearest_nursing": "nearest nursing home in {pincode}"
+    }
+}
+
+FACILITY_NAMES = {
+    "nearest_hospitals": "🏥 Nearest Hospitals",
+    "nearest_clinics": "🏢 Nearest Clinics",
+    "nearest_nursing": "🏘️ Nearest Nursing Homes"
+}
+
+
+@lru_cache(maxsize=4096)
+def _cached_search_links(specialist: str, facility_type: str, pincode: str) -> Dict:
+    """Build (and cache) the search links; each query string is URL-encoded only once.
+    The returned dict is shared between callers and must not be mutated."""
+    specialist_keyword = FacilitiesService.SPECIALIST_KEYWORDS.get(
+        specialist,
+        specialist or "hospital"
+    )
+
+    templates = FACILITY_SEARCH_TEMPLATES.get(facility_type, FACILITY_SEARCH_TEMPLATES["all"])
+
+    links = {}
+    for key, template in templates.items():
+        search_query = template.format(keyword=specialist_keyword, pincode=pincode)
+        encoded_query = quote(search_query)
+
+        links[key] = {
+            "name": FACILITY_NAMES.get(key, key),
+            "google_maps": f"https://www.google.com/maps/search/{encoded_query}",
+            "google_search": f"https://www.google.com/search?q={encoded_query}",
+            "display_text": search_query,
+            "type": key.replace("nearest_", "")
         }
-        
-        for key, search_query in searches.items():
-            encoded_query = quote(search_query)
-            
-            links[key] = {
-                "name": facility_names.get(key, key),
-                "google_maps": f"https://www.google.com/maps/search/{encoded_query}",
-                "google_search": f"https://www.google.com/search?q={encoded_query}",
-                "display_text": search_query,
-                "type": key.replace("nearest_", "")
-            }
 
-        return links
+    return links
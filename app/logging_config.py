@@ -0,0 +1,47 @@
+# ============================================================
+# Imports
+# ============================================================
+
+import atexit
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+
+# ============================================================
+# Logging Configuration
+# ============================================================
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+_listener = None  # Background QueueListener, started once per process
+
+def setup_logging():
+    """
+    Configure the root logger to enqueue records through a QueueHandler.
+    A background QueueListener thread owns the stdout StreamHandler, so request
+    handlers on the event loop never block on console I/O.
+    Level comes from the LOG_LEVEL env variable (default INFO; DEBUG for per-turn traces).
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    # Load environment variables from .env file (LOG_LEVEL may be set there)
+    load_dotenv()
+    level = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.Queue(-1)  # Unbounded: enqueueing never blocks
+    root_logger = logging.getLogger()
+    root_logger.handlers = [QueueHandler(log_queue)]
+    root_logger.setLevel(level)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # Flush any queued records on interpreter exit
+    atexit.register(_listener.stop)
@@ -5,9 +5,13 @@
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
-from app.api import router as api_router
+from app.logging_config import setup_logging
+setup_logging()  # Configure before other app modules are imported so nothing logs unconfigured
+from app.api import router as api_router, get_engine, get_chain
 from dotenv import load_dotenv
+import asyncio
 import os
 import sys
 
@@ -27,7 +31,8 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
-    openapi_url="/api/openapi.json"
+    openapi_url="/api/openapi.json",
+    default_response_class=ORJSONResponse  # orjson serializes responses much faster than stdlib json
 )
 
 # ============================================================
@@ -138,11 +143,23 @@ async def startup_event():
     print(f" ReDoc: http://127.0.0.1:8000/api/redoc")
     print(f"  Health Check: http://127.0.0.1:8000/health")
     print("="*60)
+    # Build the engine in this worker (off the event loop), then warm it up
+    engine = await asyncio.to_thread(get_engine)
+    await asyncio.to_thread(get_chain)
+    try:
+        await engine.warmup()
+    except Exception as e:
+        # A failed warmup only means the first request pays the cold-start cost
+        print(f"Warning: Warmup failed: {e}")
+    app.state.keepalive_task = asyncio.create_task(engine.keepalive())
     print("\n Server initialized successfully!\n")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Called when FastAPI server shuts down."""
+    keepalive_task = getattr(app.state, "keepalive_task", None)
+    if keepalive_task:
+        keepalive_task.cancel()
     print("\n MedSage Server shutting down...\n")
 
 # ============================================================
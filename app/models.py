@@ -2,7 +2,7 @@
 # Imports
 # ============================================================
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
 
 # ============================================================
@@ -12,7 +12,10 @@ from typing import List, Optional
 class Turn(BaseModel):
     """
     Represents a single turn in the conversation (Human <-> AI).
+    Frozen: turns are never mutated once created.
     """
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     human: str  # Human/user message
     ai: str     # AI response
 
@@ -25,6 +28,8 @@ class UserDetails(BaseModel):
     Stores required and optional details for a patient/user.
     All fields optional for flexibility.
     """
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     name: Optional[str] = None
     dob: Optional[str] = None
     gender: Optional[str] = None
@@ -3,21 +3,59 @@
 # ============================================================
 
 import os
+import requests
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from langchain_nvidia_ai_endpoints import ChatNVIDIA
 
 # ============================================================
-# NVIDIA NIM LLM Client Initialization
+# Environment Check
 # ============================================================
 
-def get_nim_llm():
-
-    # Load environment variables from .env file
+# Load environment variables from .env file (only if the key is not already exported)
+if os.environ.get("NVIDIA_API_KEY") is None:
     load_dotenv()
 
-    # Ensure NVIDIA API key is set in environment for authentication
-    if os.environ.get("NVIDIA_API_KEY") is None:
-        raise EnvironmentError("NVIDIA_API_KEY not found in .env file.")
+# Fail at import time rather than on the first request
+if os.environ.get("NVIDIA_API_KEY") is None:
+    raise EnvironmentError("NVIDIA_API_KEY not found in .env file.")
+
+# ============================================================
+# Shared HTTP Connection Pool
+# ============================================================
+
+HTTP_POOL_SIZE = 64  # Max keep-alive connections to the NIM endpoint
+
+_http_session = None  # One pooled session shared by every ChatNVIDIA client
+
+def _get_http_session(verify_ssl: bool = True) -> requests.Session:
+    """
+    Return the process-wide pooled requests.Session.
+    ChatNVIDIA otherwise opens a fresh Session (new TCP + TLS handshake) for
+    every call; reusing one keeps connections alive between chat turns.
+    """
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        session.verify = verify_ssl
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_session = session
+    return _http_session
+
+# ============================================================
+# NVIDIA NIM LLM Client Initialization
+# ============================================================
+
+@lru_cache(maxsize=1)
+def get_nim_llm():
+    """
+    Return the process-wide ChatNVIDIA client (built on first call, then reused).
+    Callers needing different generation settings should use llm.bind(...)
+    rather than mutating the shared instance.
+    """
 
     # Initialize the ChatNVIDIA LLM client with the specified model
     # You can swap out the model name as needed
@@ -27,4 +65,8 @@ def get_nim_llm():
         max_tokens=1024
     )
 
+    # Route all requests through the shared keep-alive connection pool
+    session = _get_http_session(getattr(llm._client, "verify_ssl", True))
+    llm._client.get_session_fn = lambda: session
+
     return llm
@@ -2,13 +2,15 @@
 # Imports
 # ============================================================
 
-from langchain_core.prompts import PromptTemplate
+from langchain_core.prompts import ChatPromptTemplate
 
 # ============================================================
 # Diagnostic Prompt Template
 # ============================================================
 
-DIAGNOSTIC_PROMPT_TEMPLATE = """
+# Static instructions come first and never change between turns, so the
+# provider can reuse the cached prefix; per-turn values trail at the end.
+DIAGNOSTIC_SYSTEM_TEMPLATE = """
 You are a virtual medical assistant trained to reason through patient symptoms to identify possible causes and guide them toward the appropriate medical specialist.
 
 Your task is to:
@@ -46,12 +48,6 @@ Your task is to:
 
 ---
 
-**Context:**
-{context}
-
-**Patient’s Description:**
-{history}
-
 **Scope & Topic Boundaries:**
 - Stay focused on analyzing medical symptoms and guiding toward appropriate care.
 - If the patient asks questions unrelated to their symptoms or medical guidance, politely redirect: "I'm here to help with your specific symptoms. Let's focus on [symptom/concern]. Can you tell me more about...?"
@@ -59,16 +55,24 @@ Your task is to:
 - If uncertain about a symptom's cause, acknowledge uncertainty clearly rather than guessing.
 """
 
-DIAGNOSTIC_PROMPT = PromptTemplate(
-    input_variables=["history", "context"],
-    template=DIAGNOSTIC_PROMPT_TEMPLATE
-)
+DIAGNOSTIC_HUMAN_TEMPLATE = """
+**Context:**
+{context}
+
+**Patient’s Description:**
+{history}
+"""
+
+DIAGNOSTIC_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", DIAGNOSTIC_SYSTEM_TEMPLATE),
+    ("human", DIAGNOSTIC_HUMAN_TEMPLATE)
+])
 
 # ============================================================
 # Input Classification Prompt Template
 # ============================================================
 
-CLASSIFICATION_PROMPT_TEMPLATE = """
+CLASSIFICATION_SYSTEM_TEMPLATE = """
 Analyze the last user message in the context of the last AI question.
 Classify the user's input based ONLY on whether it introduces NEW potential symptoms or significant diagnostic details not previously discussed. Ignore simple affirmations, negations, or direct answers to the question asked.
 
@@ -77,24 +81,26 @@ Classify the user's input based ONLY on whether it introduces NEW potential symp
 Classification options:
 - NEW_INFO
 - ANSWER_ONLY
+"""
 
+CLASSIFICATION_HUMAN_TEMPLATE = """
 Last AI Question: "{last_ai_question}"
 Last User Message: "{user_input}"
 
 Classification Label: """  # Note: Label expected alone, no extra text
 
-CLASSIFICATION_PROMPT = PromptTemplate(
-    input_variables=["last_ai_question", "user_input"],
-    template=CLASSIFICATION_PROMPT_TEMPLATE
-)
+CLASSIFICATION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", CLASSIFICATION_SYSTEM_TEMPLATE),
+    ("human", CLASSIFICATION_HUMAN_TEMPLATE)
+])
 
 # ============================================================
 # PDF Report Summary Prompt Template
 # ============================================================
 
-SUMMARY_PROMPT_TEMPLATE = """
+SUMMARY_SYSTEM_TEMPLATE = """
 You are a medical scribe summarizing a patient's interaction with an AI diagnostic assistant (MedSage) for a healthcare professional.
-Review the entire conversation history provided below.
+Review the entire conversation history provided by the user.
 
 Your task is to generate a concise clinical summary report including:
 1.  **Chief Complaint:** The primary reason the patient initiated the chat (initial symptoms).
@@ -102,8 +108,9 @@ Your task is to generate a concise clinical summary report including:
 3.  **AI Assistant's Assessment:** The final likely diagnosis or differential diagnoses suggested by the AI assistant, along with its reasoning, severity assessment, and specialist recommendation, as stated in the final AI message.
 
 **Format:** Use clear headings for each section (Chief Complaint, HPI, AI Assessment). Be objective and use medical terminology appropriately but avoid jargon where simpler terms suffice. Focus only on the information present in the chat.
+"""
 
----
+SUMMARY_HUMAN_TEMPLATE = """
 [CONVERSATION HISTORY]
 {full_history}
 ---
@@ -111,7 +118,7 @@ Your task is to generate a concise clinical summary report including:
 [GENERATED CLINICAL SUMMARY REPORT]
 """
 
-SUMMARY_PROMPT = PromptTemplate(
-    input_variables=["full_history"],
-    template=SUMMARY_PROMPT_TEMPLATE
-)
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SUMMARY_SYSTEM_TEMPLATE),
+    ("human", SUMMARY_HUMAN_TEMPLATE)
+])
@@ -3,16 +3,32 @@
 # ============================================================
 
 from fpdf import FPDF, XPos, YPos
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+import re
 from app.nim_client import get_nim_llm
 from app import prompts
 from langchain_core.output_parsers import StrOutputParser
 
+# ============================================================
+# Configuration Constants
+# ============================================================
+
+SUMMARY_MAX_TOKENS = 512  # Cap on summary length; output tokens dominate LLM latency
+SHORT_SESSION_TOKEN_THRESHOLD = 300  # Below this (estimated) history size, skip the LLM summary
+CHARS_PER_TOKEN = 4  # Rough characters-per-token ratio for the estimate
+
 # ============================================================
 # PDF Report Class Extending FPDF
 # ============================================================
 
 class PDF(FPDF):
+    # Markdown "* " bullets at line start, rendered as "- " so list items stay visible
+    _BULLET_RE = re.compile(r'^(\s*)\* ', re.MULTILINE)
+    # Paired emphasis and code markers stripped from LLM text in one regex pass;
+    # single * and _ are kept (bullets, identifiers such as snake_case names)
+    _MD_RE = re.compile(r'\*\*|__|`')
+
     def header(self):
         """
         Create a custom header for each PDF page with branding.
@@ -54,9 +70,9 @@ class PDF(FPDF):
 
     def clean_text(self, text):
         """
-        Remove markdown markers like ** for clean display.
+        Remove markdown markers (**, __, `) for clean display; "* " bullets become "- ".
         """
-        return text.replace('**', '')
+        return self._MD_RE.sub('', self._BULLET_RE.sub(r'\1- ', text))
 
     def section_body(self, text):
         """
@@ -65,7 +81,10 @@ class PDF(FPDF):
         clean = self.clean_text(text)
         self.set_font('Helvetica', '', 10)
         self.set_text_color(50, 50, 50)
-        self.multi_cell(w=0, h=6, text=clean, border=0, align='L', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        # Wrap once (dry run), then emit one plain cell per line
+        lines = self.multi_cell(w=0, h=6, text=clean, border=0, align='L', dry_run=True, output='LINES')
+        for line in lines:
+            self.cell(w=0, h=6, text=line, border=0, align='L', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         self.ln(2)
 
     def key_value(self, key, value):
@@ -83,49 +102,21 @@ class PDF(FPDF):
         self.ln(1)
 
 # ============================================================
-# Function to Generate PDF Report Bytes from Chat History and User Details
+# Report Building Helpers
 # ============================================================
 
-def generate_report_pdf(user_details: dict | None, chat_history: list) -> bytes:
+def _render_front_matter(user_details: dict | None) -> PDF:
     """
-    Generate a polished PDF report summarizing the diagnostic session.
+    Create the PDF and render everything that precedes the clinical summary:
+    the title header and the patient information section.
 
     Args:
         user_details: Optional dict or Pydantic model with patient info.
-        chat_history: List of chat turns containing human and AI messages.
 
     Returns:
-        bytes representing the PDF file content.
-
-    Raises:
-        ValueError: If chat history is empty.
+        PDF object positioned where the clinical summary should start.
     """
 
-    # Build full conversation string from chat history
-    full_history_str = ""
-    for turn in chat_history:
-        human_msg = getattr(turn, 'human', turn.get('human', ''))
-        ai_msg = getattr(turn, 'ai', turn.get('ai', ''))
-        if human_msg:
-            full_history_str += f"Patient: {human_msg}\n\n"
-        if ai_msg:
-            full_history_str += f"MedSage Assistant: {ai_msg}\n\n"
-    full_history_str = full_history_str.strip()
-
-    if not full_history_str:
-        raise ValueError("Chat history is empty.")
-
-    # Generate clinical summary using LLM and prompt
-    print("[Report Gen] Generating clinical summary...")
-    try:
-        llm = get_nim_llm()
-        summary_chain = prompts.SUMMARY_PROMPT | llm | StrOutputParser()
-        clinical_summary = summary_chain.invoke({"full_history": full_history_str})
-        print("[Report Gen] Summary generated successfully.")
-    except Exception as e:
-        print(f"[Report Gen] Error: {e}")
-        clinical_summary = "Clinical summary could not be generated at this time."
-
     # Initialize PDF document
     pdf = PDF(orientation='P', unit='mm', format='A4')
     pdf.add_page()
@@ -162,6 +153,83 @@ def generate_report_pdf(user_details: dict | None, chat_history: list) -> bytes:
         if user_dict.get('symptoms'):
             pdf.key_value("Initial Symptoms", user_dict.get('symptoms'))
 
+    return pdf
+
+
+def _template_summary(first_human_msg: str, last_ai_msg: str) -> str:
+    """
+    Build a short clinical summary locally for sessions too brief to need the LLM:
+    the first patient message as the chief complaint and the last assistant message
+    as the assessment.
+    """
+    return (
+        f"**Chief Complaint:** {first_human_msg or 'Not stated.'}\n\n"
+        f"**AI Assessment:** {last_ai_msg or 'No assessment was given in this session.'}"
+    )
+
+# ============================================================
+# Function to Generate PDF Report Bytes from Chat History and User Details
+# ============================================================
+
+def generate_report_pdf(user_details: dict | None, chat_history: list) -> bytearray:
+    """
+    Generate a polished PDF report summarizing the diagnostic session.
+
+    Args:
+        user_details: Optional dict or Pydantic model with patient info.
+        chat_history: List of chat turns containing human and AI messages.
+
+    Returns:
+        bytearray with the PDF file content, as produced by fpdf2 (bytes-like;
+        returned as-is to avoid copying the whole document).
+
+    Raises:
+        ValueError: If chat history is empty.
+    """
+
+    # Build full conversation string from chat history
+    full_history_str = ""
+    first_human_msg, last_ai_msg = "", ""
+    for turn in chat_history:
+        human_msg = getattr(turn, 'human', turn.get('human', ''))
+        ai_msg = getattr(turn, 'ai', turn.get('ai', ''))
+        if human_msg:
+            full_history_str += f"Patient: {human_msg}\n\n"
+            first_human_msg = first_human_msg or human_msg
+        if ai_msg:
+            full_history_str += f"MedSage Assistant: {ai_msg}\n\n"
+            last_ai_msg = ai_msg
+    full_history_str = full_history_str.strip()
+
+    if not full_history_str:
+        raise ValueError("Chat history is empty.")
+
+    # Render the title and patient info in a worker thread while the summary streams in:
+    # that part of the document does not depend on the LLM output
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        front_matter = executor.submit(_render_front_matter, user_details)
+
+        if len(full_history_str) // CHARS_PER_TOKEN < SHORT_SESSION_TOKEN_THRESHOLD:
+            # Too short to be worth an LLM round-trip: template the summary locally
+            print("[Report Gen] Short-session fast path")
+            clinical_summary = _template_summary(first_human_msg, last_ai_msg)
+        else:
+            # Generate clinical summary using LLM and prompt
+            print("[Report Gen] Generating clinical summary...")
+            try:
+                llm = get_nim_llm().bind(max_tokens=SUMMARY_MAX_TOKENS)
+                summary_chain = prompts.SUMMARY_PROMPT | llm | StrOutputParser()
+                summary_chunks = []
+                for chunk in summary_chain.stream({"full_history": full_history_str}):
+                    summary_chunks.append(chunk)
+                clinical_summary = "".join(summary_chunks)
+                print("[Report Gen] Summary generated successfully.")
+            except Exception as e:
+                print(f"[Report Gen] Error: {e}")
+                clinical_summary = "Clinical summary could not be generated at this time."
+
+        pdf = front_matter.result()
+
     # Clinical Summary Section
     pdf.section_title('CLINICAL SUMMARY')
     pdf.section_body(clinical_summary)
@@ -187,5 +255,5 @@ def generate_report_pdf(user_details: dict | None, chat_history: list) -> bytes:
     )
     pdf.multi_cell(w=0, h=5, text=disclaimer, border=1, align='L', fill=True)
 
-    # Output PDF as bytes
+    # Output PDF buffer (no bytes() conversion: callers only need a bytes-like object)
     return pdf.output()
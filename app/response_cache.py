@@ -0,0 +1,149 @@
+# ============================================================
+# Imports
+# ============================================================
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import numpy as np
+import xxhash
+from cachetools import TTLCache
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# Configuration Constants
+# ============================================================
+
+CACHE_MAX_SIZE = 2048          # Maximum number of cached chat responses
+CACHE_TTL_SECONDS = 3600       # Cached responses expire after one hour
+SEMANTIC_SIM_THRESHOLD = 0.95  # Cosine similarity needed for a semantic hit
+
+# The semantic layer is off unless MEDSAGE_SEMANTIC_CACHE=1: sentence embeddings can
+# place messages with opposite clinical meaning ("I have chest pain" / "I have no
+# chest pain") above the threshold, so only exact repeats are served by default.
+SEMANTIC_CACHE_ENABLED = os.environ.get("MEDSAGE_SEMANTIC_CACHE") == "1"
+
+# ============================================================
+# ResponseCache Class
+# Exact + semantic cache for /chat responses
+# ============================================================
+
+class ResponseCache:
+    def __init__(self, embed_fn: Optional[Callable[[str], List[float]]] = None):
+        """
+        Initialize the response cache.
+
+        Args:
+            embed_fn: Optional function mapping a user message to an embedding vector.
+                      When provided, near-identical messages after the same history
+                      are served from cache (semantic layer).
+        """
+        self.embed_fn = embed_fn
+        # cachetools caches are not thread-safe, and aget/aset run lookups in worker threads
+        self._lock = threading.Lock()
+        # Exact layer: key -> ChatResponse dict
+        self.responses = TTLCache(maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL_SECONDS)
+        # Semantic layer: history key -> list of (normalized query embedding, exact key)
+        self.semantic_index = TTLCache(maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL_SECONDS)
+
+    # ============================================================
+    # Key Helpers
+    # ============================================================
+
+    @staticmethod
+    def _hash(payload) -> int:
+        """
+        Stable hash of a JSON-serializable payload (canonical JSON + xxh3).
+        Unlike hash(), xxh3 is not salted per process, so keys agree across workers.
+        """
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return xxhash.xxh3_64_intdigest(canonical.encode())
+
+    def make_key(self, history: List[dict], query: str) -> int:
+        """
+        Build the exact-match cache key from the history and the new query.
+        """
+        return self._hash({"h": history, "q": query})
+
+    def _history_key(self, history: List[dict]) -> int:
+        return self._hash({"h": history})
+
+    def _embed(self, query: str) -> Optional[np.ndarray]:
+        if self.embed_fn is None:
+            return None
+        vector = np.asarray(self.embed_fn(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    # ============================================================
+    # Lookup & Store
+    # ============================================================
+
+    def get(self, history: List[dict], query: str) -> Optional[dict]:
+        """
+        Return a cached response for (history, query), or None on a miss.
+        Tries the exact layer first, then the semantic layer.
+        """
+        key = self.make_key(history, query)
+        with self._lock:
+            cached = self.responses.get(key)
+            # Semantic lookup is restricted to entries sharing the same history,
+            # so a similar message in a different conversation never matches.
+            candidates = self.semantic_index.get(self._history_key(history)) if self.embed_fn else None
+        if cached is not None:
+            logger.debug("[Cache] Exact hit")
+            return cached
+        if not candidates:
+            return None
+
+        # Embedding runs outside the lock
+        query_vector = self._embed(query)
+        if query_vector is None:
+            return None
+        for cached_vector, key in candidates:
+            if float(np.dot(query_vector, cached_vector)) >= SEMANTIC_SIM_THRESHOLD:
+                with self._lock:
+                    cached = self.responses.get(key)
+                if cached is not None:
+                    logger.debug("[Cache] Semantic hit")
+                    return cached
+        return None
+
+    def set(self, history: List[dict], query: str, response: dict) -> None:
+        """
+        Store a response for (history, query) in both cache layers.
+        """
+        key = self.make_key(history, query)
+        query_vector = self._embed(query)
+        with self._lock:
+            self.responses[key] = response
+            if query_vector is not None:
+                history_key = self._history_key(history)
+                entries = self.semantic_index.get(history_key, [])
+                self.semantic_index[history_key] = entries + [(query_vector, key)]
+
+    # ============================================================
+    # Async Wrappers
+    # ============================================================
+
+    async def aget(self, history: List[dict], query: str) -> Optional[dict]:
+        """
+        Async get(). With the semantic layer on, the lookup (which may embed the
+        query) runs in a worker thread so the model forward pass never blocks the event loop.
+        """
+        if self.embed_fn is None:
+            return self.get(history, query)
+        return await asyncio.to_thread(self.get, history, query)
+
+    async def aset(self, history: List[dict], query: str, response: dict) -> None:
+        """
+        Async set(), off the event loop when the query has to be embedded.
+        """
+        if self.embed_fn is None:
+            self.set(history, query, response)
+        else:
+            await asyncio.to_thread(self.set, history, query, response)
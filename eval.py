@@ -6,18 +6,29 @@ import pandas as pd
 from rag_system.retriever import AdvancedRetriever
 import time
 import re
+import logging
+import numpy as np
+import os
+import torch
 from difflib import SequenceMatcher  # Imported but not currently used
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import util
+
+logger = logging.getLogger(__name__)
 
 # ============================================================
 # Constants and Configuration
 # ============================================================
 
-embedding_model = SentenceTransformer('./all-MiniLM-L6-v2')  # Load embedding model once
+embedding_model = None  # SentenceTransformer shared with the retriever (set in evaluate_retriever)
+DOC_EMBEDDINGS_PATH = "rag_system/vector_store/doc_embeddings.npy"  # Written by build_index.py
 COSINE_SIM_THRESHOLD = 0.85  # Threshold for semantic cosine similarity
 EVAL_DATA_PATH = "eval.csv"  # Evaluation data filepath
 K = 10  # Number of top documents to consider in metrics
 SIMILARITY_THRESHOLD = 0.9  # For SequenceMatcher (optional, currently unused)
+ENCODE_BATCH_SIZE = 256 if torch.cuda.is_available() else 64  # Larger batches when the GPU holds the model
+EVAL_DEBUG_ENV = "MEDSAGE_EVAL_DEBUG"  # Set to 1 to log per-query/per-rank metric details
+WHITESPACE_PATTERN = re.compile(r'\s+')  # Runs of whitespace, collapsed to one space
+PUNCTUATION_PATTERN = re.compile(r'[.,!?"\'-]')  # Punctuation removed during normalization
 
 
 # ============================================================
@@ -31,12 +42,51 @@ def normalize_text(text: str) -> str:
     if not isinstance(text, str):
         return ""
     text = text.lower().strip()
-    text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
-    text = re.sub(r'[.,!?"\'-]', '', text)  # Remove punctuation (adjust as needed)
+    text = WHITESPACE_PATTERN.sub(' ', text)  # Normalize whitespace
+    text = PUNCTUATION_PATTERN.sub('', text)  # Remove punctuation (adjust as needed)
     return text
 
 
-def calculate_metrics(retrieved_docs: list[str], relevant_docs: list[str], k: int, query_index: int) -> tuple[int, float]:
+class CorpusEmbeddings:
+    """
+    Read-only {document text: embedding} view over the memory-mapped corpus
+    embeddings saved by build_index.py, so retrieved docs need no re-encoding.
+    """
+
+    def __init__(self, docs: list[str], path: str, device):
+        self.embeddings = np.load(path, mmap_mode='r')
+        # A file left over from another index build would silently return wrong vectors
+        if self.embeddings.shape[0] != len(docs):
+            raise ValueError(f"{path} has {self.embeddings.shape[0]} embeddings for {len(docs)} documents")
+        self.doc_index = {doc: i for i, doc in enumerate(docs)}
+        self.device = device
+
+    def __contains__(self, doc: str) -> bool:
+        return doc in self.doc_index
+
+    def take(self, docs: list[str]) -> torch.Tensor:
+        """
+        Embeddings of docs, stacked: one indexed read from the mapped file, one device copy.
+        """
+        rows = self.embeddings[[self.doc_index[doc] for doc in docs]]
+        return torch.from_numpy(rows).to(self.device)
+
+
+def embed_docs(docs: list[str], embedding_cache=None) -> torch.Tensor:
+    """
+    Embed documents, taking them from embedding_cache (a text -> tensor dict or a
+    CorpusEmbeddings) when every doc is present and encoding them in one batch otherwise.
+    """
+    if embedding_cache is not None and all(doc in embedding_cache for doc in docs):
+        if isinstance(embedding_cache, CorpusEmbeddings):
+            return embedding_cache.take(docs)
+        return torch.stack([embedding_cache[doc] for doc in docs])
+    return embedding_model.encode(docs, batch_size=len(docs), convert_to_tensor=True)
+
+
+def calculate_metrics(retrieved_docs: list[str], relevant_docs: list[str], k: int, query_index: int,
+                      relevant_embedding_cache: dict | None = None,
+                      retrieved_embedding_cache=None) -> tuple[int, float]:
     """
     Calculate Hit Rate and Mean Reciprocal Rank (MRR) for one query.
     Uses cosine similarity of embeddings with threshold defined globally.
@@ -46,6 +96,8 @@ def calculate_metrics(retrieved_docs: list[str], relevant_docs: list[str], k: in
         relevant_docs: List of expected relevant document texts.
         k: Top-k cutoff for evaluation.
         query_index: Index for logging/debugging.
+        relevant_embedding_cache: Optional {text: embedding} of pre-encoded relevant docs.
+        retrieved_embedding_cache: Optional {text: embedding} of corpus docs (e.g. CorpusEmbeddings).
     
     Returns:
         hit (int): 1 if any retrieved doc matches relevant docs semantically, 0 otherwise.
@@ -60,34 +112,33 @@ def calculate_metrics(retrieved_docs: list[str], relevant_docs: list[str], k: in
     retrieved_docs = [doc for doc in top_k_retrieved if isinstance(doc, str) and doc.strip()]
 
     if not relevant_docs or not retrieved_docs:
-        print(f"  [MetricsDebug Q{query_index}] Missing valid relevant or retrieved docs.")
+        logger.debug("  [MetricsDebug Q%d] Missing valid relevant or retrieved docs.", query_index)
         return 0, 0.0
 
-    # Encode documents into embeddings (Tensor format)
-    relevant_embeddings = embedding_model.encode(relevant_docs, convert_to_tensor=True)
-    retrieved_embeddings = embedding_model.encode(retrieved_docs, convert_to_tensor=True)
+    # Encode documents into embeddings (Tensor format), reusing cached embeddings when available
+    relevant_embeddings = embed_docs(relevant_docs, relevant_embedding_cache)
+    retrieved_embeddings = embed_docs(retrieved_docs, retrieved_embedding_cache)
 
-    found_match_at_rank = -1
+    # One similarity matrix for all pairs: shape [len(retrieved), len(relevant)]
+    # float(): fp16 model outputs and fp32 memory-mapped embeddings may be mixed; stays on device
+    similarity = util.cos_sim(retrieved_embeddings.float(), relevant_embeddings.float())
+    max_similarity_per_rank = similarity.max(dim=1).values
+    matches = max_similarity_per_rank >= COSINE_SIM_THRESHOLD
 
-    # Check each retrieved doc against all relevant docs for semantic similarity
-    for rank, retrieved_emb in enumerate(retrieved_embeddings, 1):
-        cosine_scores = util.cos_sim(retrieved_emb, relevant_embeddings)
-        max_similarity = float(cosine_scores.max())
+    if logger.isEnabledFor(logging.DEBUG):
+        for rank, max_similarity in enumerate(max_similarity_per_rank.tolist(), 1):
+            logger.debug("    [MetricsDebug Q%d Rank %d] Max Cosine Similarity: %.4f", query_index, rank, max_similarity)
 
-        print(f"    [MetricsDebug Q{query_index} Rank {rank}] Max Cosine Similarity: {max_similarity:.4f}")
-
-        if max_similarity >= COSINE_SIM_THRESHOLD:
-            print(f"    [MetricsDebug Q{query_index} Rank {rank}] ---> SEMANTIC MATCH FOUND (cos_sim >= {COSINE_SIM_THRESHOLD})")
-            if found_match_at_rank == -1:
-                found_match_at_rank = rank
-            break  # Stop checking after first match
+    # Rank (1-based) of the first retrieved doc that matches any relevant doc
+    found_match_at_rank = int(matches.nonzero()[0]) + 1 if matches.any() else -1
 
     if found_match_at_rank != -1:
         hit = 1
         reciprocal_rank = 1.0 / found_match_at_rank
-        print(f"  [MetricsDebug Q{query_index}] First match at Rank {found_match_at_rank}. Hit=1, RR={reciprocal_rank:.4f}")
+        logger.debug("  [MetricsDebug Q%d] First match at Rank %d. Hit=1, RR=%.4f",
+                     query_index, found_match_at_rank, reciprocal_rank)
     else:
-        print(f"  [MetricsDebug Q{query_index}] No semantic match found in Top {k}. Hit=0, RR=0.0")
+        logger.debug("  [MetricsDebug Q%d] No semantic match found in Top %d. Hit=0, RR=0.0", query_index, k)
 
     return hit, reciprocal_rank
 
@@ -107,6 +158,18 @@ def evaluate_retriever():
         print(f"Failed to initialize retriever: {e}")
         return
 
+    # Reuse the retriever's SentenceTransformer instead of loading a second copy
+    global embedding_model
+    embedding_model = retriever.embedding_model._client
+
+    corpus_embeddings = None
+    if os.path.exists(DOC_EMBEDDINGS_PATH):
+        try:
+            corpus_embeddings = CorpusEmbeddings(retriever.bm25_docs, DOC_EMBEDDINGS_PATH, embedding_model.device)
+            print(f"Memory-mapped corpus embeddings from: {DOC_EMBEDDINGS_PATH}")
+        except ValueError as e:
+            print(f"Warning: Ignoring stale corpus embeddings ({e}); retrieved docs will be re-encoded.")
+
     print(f"Loading evaluation data from: {EVAL_DATA_PATH}")
     try:
         eval_df = pd.read_csv(EVAL_DATA_PATH)
@@ -123,6 +186,16 @@ def evaluate_retriever():
     total_reciprocal_rank = 0.0
     start_time = time.time()
 
+    # Relevant docs are fixed per dataset: encode every unique one once, in large batches
+    all_relevant_docs = list(dict.fromkeys(
+        doc for col in relevant_cols for doc in eval_df[col].dropna().astype(str).str.strip() if doc
+    ))
+    print(f"Pre-encoding {len(all_relevant_docs)} unique relevant documents...")
+    relevant_embeddings = embedding_model.encode(
+        all_relevant_docs, batch_size=ENCODE_BATCH_SIZE, convert_to_tensor=True, show_progress_bar=True
+    )
+    relevant_embedding_cache = dict(zip(all_relevant_docs, relevant_embeddings))
+
     print(f"\nRunning evaluation for Top {K} results...")
     queries_evaluated_count = 0
 
@@ -140,8 +213,7 @@ def evaluate_retriever():
         print(f"\n--- Query {query_index}/{len(eval_df)}: '{query}' ---")
         print(f"Expected Relevant Doc(s) (first 100 chars): {[doc[:100]+'...' for doc in relevant_docs]}")
 
-        retrieved_docs_str = retriever.search(query, k_final=K)
-        retrieved_docs_list = retrieved_docs_str.split("\n\n---\n\n") if retrieved_docs_str else []
+        retrieved_docs_list = retriever.search_docs(query, k_final=K)
         print(f"Retrieved {len(retrieved_docs_list)} docs.")
 
         print("Top Retrieved Docs (first 100 chars):")
@@ -150,7 +222,8 @@ def evaluate_retriever():
         for i, doc in enumerate(retrieved_docs_list[:K]):
             print(f"  {i+1}. {doc[:100]}...")
 
-        hit, reciprocal_rank = calculate_metrics(retrieved_docs_list, relevant_docs, K, query_index)
+        hit, reciprocal_rank = calculate_metrics(retrieved_docs_list, relevant_docs, K, query_index,
+                                                 relevant_embedding_cache, corpus_embeddings)
         total_hits += hit
         total_reciprocal_rank += reciprocal_rank
         print(f"Result for Query {query_index}: Hit={hit}, RR={reciprocal_rank:.4f}")
@@ -174,4 +247,9 @@ def evaluate_retriever():
 # ============================================================
 
 if __name__ == "__main__":
+    # Metric details are DEBUG records: off unless MEDSAGE_EVAL_DEBUG=1
+    logging.basicConfig(
+        level=logging.DEBUG if os.environ.get(EVAL_DEBUG_ENV) == "1" else logging.INFO,
+        format="%(message)s"
+    )
     evaluate_retriever()
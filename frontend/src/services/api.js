@@ -22,9 +22,12 @@ export const submitPatientInfo = async (patientData) => {
 
 export const sendChat = async (query, history) => {
   try {
+    // /chat streams SSE by default; the chat UI consumes the full JSON response
     const response = await apiClient.post("/chat", {
       query: query,
       history: history,
+    }, {
+      params: { stream: false },
     });
     return response.data;
   } catch (error) {
@@ -3,22 +3,90 @@
 # ============================================================
 
 import pandas as pd
+import faiss
+import uuid
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
 from langchain_huggingface import HuggingFaceEmbeddings
-from rank_bm25 import BM25Okapi
+from scipy.sparse import csc_matrix
+from collections import Counter
+import numpy as np
 import pickle
 import os
+import re
 import time
 
 # ============================================================
 # Configuration Paths and Parameters
 # ============================================================
 
-PROCESSED_DATA_PATH = "data/processed/medsage_processed.csv"
+PROCESSED_DATA_PATH = "data/processed/medsage_processed.parquet"
+# CSV output of older preprocessing runs, used when no Parquet file exists
+PROCESSED_CSV_PATH = "data/processed/medsage_processed.csv"
 VECTOR_STORE_PATH = "rag_system/vector_store"
 BM25_INDEX_PATH = "rag_system/vector_store/bm25_index.pkl"
+# Per-document embeddings (same row order as the FAISS index and BM25 docs)
+DOC_EMBEDDINGS_PATH = "rag_system/vector_store/doc_embeddings.npy"
 # Path to the local embedding model
 LOCAL_EMBEDDING_MODEL = "./all-MiniLM-L6-v2"
+# HNSW graph parameters (neighbours per node, build-time candidate list size)
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+# BM25 Okapi parameters (same defaults as rank_bm25.BM25Okapi)
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+# BM25 tokenizer: lowercased alphanumeric runs (drops punctuation such as "fever,").
+# Pickled with the index so the retriever tokenizes queries identically.
+BM25_TOKEN_RE = re.compile(r"[A-Za-z0-9]+")
+
+# ============================================================
+# Sparse BM25 Index
+# ============================================================
+
+def tokenize(text: str, token_re: re.Pattern = BM25_TOKEN_RE) -> list[str]:
+    """
+    Split text into lowercased BM25 tokens.
+    """
+    return token_re.findall(text.lower())
+
+def build_bm25_matrix(tokenized_corpus: list[list[str]]):
+    """
+    Precompute BM25 Okapi term weights as a sparse (n_docs x vocab_size) matrix,
+    so a query is scored with one sparse mat-vec instead of a Python loop per token.
+
+    Returns:
+        (matrix, vocab, idf): CSC matrix of per-document term weights
+        tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len / avgdl)), the term -> column
+        mapping, and the IDF of each column (negative IDFs floored as in rank_bm25).
+    """
+    vocab = {}
+    rows, cols, term_freqs = [], [], []
+    for doc_id, doc in enumerate(tokenized_corpus):
+        for term, tf in Counter(doc).items():
+            rows.append(doc_id)
+            cols.append(vocab.setdefault(term, len(vocab)))
+            term_freqs.append(tf)
+
+    n_docs = len(tokenized_corpus)
+    rows = np.asarray(rows, dtype=np.int32)
+    cols = np.asarray(cols, dtype=np.int32)
+    term_freqs = np.asarray(term_freqs, dtype=np.float32)
+    doc_lens = np.fromiter((len(doc) for doc in tokenized_corpus), dtype=np.float32, count=n_docs)
+
+    # Term weights with document length normalization
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lens / doc_lens.mean())
+    weights = term_freqs * (BM25_K1 + 1) / (term_freqs + length_norm[rows])
+    # CSC: a query only touches the columns of its own terms
+    matrix = csc_matrix((weights, (rows, cols)), shape=(n_docs, len(vocab)), dtype=np.float32)
+
+    # IDF per term; negative values are replaced by epsilon * average IDF
+    doc_freqs = np.bincount(cols, minlength=len(vocab))
+    idf = np.log(n_docs - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+    idf[idf < 0] = BM25_EPSILON * idf.mean()
+
+    return matrix, vocab, idf.astype(np.float32)
 
 # ============================================================
 # Main Function: Build and Save Indexes
@@ -26,19 +94,21 @@ LOCAL_EMBEDDING_MODEL = "./all-MiniLM-L6-v2"
 
 def build_and_save_indices():
     """
-    Reads processed data and creates both a FAISS vector index (GPU-based)
+    Reads processed data and creates both a FAISS HNSW vector index
     and a BM25 keyword index, then saves them locally.
     """
 
-    # Check if processed data exists
-    if not os.path.exists(PROCESSED_DATA_PATH):
+    # Load the processed data containing questions and answers (Parquet, else legacy CSV)
+    if os.path.exists(PROCESSED_DATA_PATH):
+        print(f"Loading processed data from {PROCESSED_DATA_PATH}...")
+        df = pd.read_parquet(PROCESSED_DATA_PATH)
+    elif os.path.exists(PROCESSED_CSV_PATH):
+        print(f"Loading processed data from {PROCESSED_CSV_PATH}...")
+        df = pd.read_csv(PROCESSED_CSV_PATH)
+    else:
         print(f"Error: Processed data not found at {PROCESSED_DATA_PATH}")
         return
 
-    # Load the processed CSV data containing questions and answers
-    print("Loading processed data...")
-    df = pd.read_csv(PROCESSED_DATA_PATH)
-
     # Remove entries with missing 'question' or 'answer'
     df.dropna(subset=['question', 'answer'], inplace=True)
 
@@ -50,30 +120,59 @@ def build_and_save_indices():
         df['semantic_types'].str.replace('|', ' ').fillna('') + " " +
         df['synonyms'].str.replace('|', ' ').fillna('')
     )
-    texts = df['text'].tolist()
-    print(f"Loaded {len(texts)} documents for indexing.")
+    # Drop duplicate documents (first occurrence kept, order preserved); the same list
+    # feeds both FAISS and BM25 so their document order stays identical for RRF
+    n_before = len(df)
+    texts = df['text'].str.strip().drop_duplicates().tolist()
+    print(f"Loaded {len(texts)} documents for indexing ({n_before - len(texts)} duplicates removed from {n_before}).")
 
     # Initialize local embedding model
     print(f"Initializing local embedding model: {LOCAL_EMBEDDING_MODEL}")
     embedding_model = HuggingFaceEmbeddings(model_name=LOCAL_EMBEDDING_MODEL)
 
-    # Build FAISS index with GPU support
-    print("Building FAISS index on GPU... This should be fast.")
+    # Embed all documents once
+    print("Embedding documents...")
     start_time = time.time()
-    vector_store = FAISS.from_texts(texts, embedding_model)
+    doc_embeddings = np.asarray(embedding_model.embed_documents(texts), dtype=np.float32)
+    print(f"Embedded {len(texts)} documents in {time.time() - start_time:.2f} seconds.")
+
+    # Build FAISS HNSW index: approximate graph search instead of an exhaustive flat scan
+    print("Building FAISS HNSW index...")
+    start_time = time.time()
+    index = faiss.IndexHNSWFlat(doc_embeddings.shape[1], HNSW_M)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.add(doc_embeddings)
+    doc_ids = [str(uuid.uuid4()) for _ in texts]
+    vector_store = FAISS(
+        embedding_function=embedding_model,
+        index=index,
+        docstore=InMemoryDocstore({doc_id: Document(page_content=text) for doc_id, text in zip(doc_ids, texts)}),
+        index_to_docstore_id=dict(enumerate(doc_ids))
+    )
     vector_store.save_local(VECTOR_STORE_PATH)
     end_time = time.time()
     print(f"FAISS index built and saved successfully in {end_time - start_time:.2f} seconds.")
 
+    # Save the document embeddings so evaluation can memory-map them instead of re-encoding
+    np.save(DOC_EMBEDDINGS_PATH, doc_embeddings)
+    print(f"Saved {doc_embeddings.shape[0]} document embeddings to {DOC_EMBEDDINGS_PATH}")
+
     # Build BM25 index (keyword-based)
     print("Building BM25 index...")
     start_time = time.time()
     # Tokenize documents for BM25
-    tokenized_corpus = [doc.split(" ") for doc in texts]
-    bm25 = BM25Okapi(tokenized_corpus)
-    # Save BM25 index and documents
+    tokenized_corpus = [tokenize(doc) for doc in texts]
+    bm25_matrix, bm25_vocab, bm25_idf = build_bm25_matrix(tokenized_corpus)
+    print(f"BM25 vocabulary size: {len(bm25_vocab)} terms.")
+    # Save BM25 weight matrix, vocabulary, IDF, tokenizer and documents
     with open(BM25_INDEX_PATH, "wb") as f:
-        pickle.dump({'bm25': bm25, 'docs': texts}, f)
+        pickle.dump({
+            'bm25_matrix': bm25_matrix,
+            'bm25_vocab': bm25_vocab,
+            'bm25_idf': bm25_idf,
+            'bm25_token_re': BM25_TOKEN_RE,
+            'docs': texts
+        }, f)
     end_time = time.time()
     print(f"BM25 index built and saved successfully in {end_time - start_time:.2f} seconds.")
 
@@ -2,14 +2,17 @@
 # Imports
 # ============================================================
 
-import pickle
+import asyncio
 import os
+import pickle
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
-from rank_bm25 import BM25Okapi
 from sentence_transformers import CrossEncoder
+from scipy.sparse import csc_matrix
 import numpy as np
-from collections import defaultdict  # Used for Reciprocal Rank Fusion (RRF) scoring
+import torch
 
 
 # ============================================================
@@ -20,7 +23,14 @@ VECTOR_STORE_PATH = "rag_system/vector_store"
 BM25_INDEX_PATH = "rag_system/vector_store/bm25_index.pkl"
 LOCAL_EMBEDDING_MODEL = "./all-MiniLM-L6-v2"
 CROSS_ENCODER_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+HNSW_EF_SEARCH = 64  # HNSW query-time candidate list size (higher = better recall, slower)
 RRF_K = 60  # Constant used in Reciprocal Rank Fusion scoring, typical value
+RERANK_MAX_LENGTH = 256  # Max tokens per (query, document) pair fed to the Cross-Encoder
+# torch.compile the Cross-Encoder on GPU; opt-in (MEDSAGE_COMPILE_CROSS_ENCODER=1) until verified on GPU hosts
+COMPILE_CROSS_ENCODER = os.environ.get("MEDSAGE_COMPILE_CROSS_ENCODER") == "1"
+# BM25 worker threads: sized like asyncio's default executor, so every concurrent
+# asearch (one to_thread worker each) gets its own BM25 thread
+BM25_MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
 
 
 # ============================================================
@@ -38,8 +48,15 @@ class AdvancedRetriever:
         """
         print("Loading local retriever components...")
 
+        # fp16 weights on GPU for both models: MiniLM inference is bound by weight bandwidth
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        fp16_kwargs = {"torch_dtype": torch.float16} if device == "cuda" else {}
+
         # Load embedding model for vector representations
-        self.embedding_model = HuggingFaceEmbeddings(model_name=LOCAL_EMBEDDING_MODEL)
+        self.embedding_model = HuggingFaceEmbeddings(
+            model_name=LOCAL_EMBEDDING_MODEL,
+            model_kwargs={"device": device, "model_kwargs": fp16_kwargs}
+        )
 
         # Load local FAISS vector store with embeddings
         self.vector_store = FAISS.load_local(
@@ -47,22 +64,114 @@ class AdvancedRetriever:
             self.embedding_model,
             allow_dangerous_deserialization=True
         )
+        # HNSW indexes trade recall for latency via efSearch; flat indexes have no such knob
+        if hasattr(self.vector_store.index, "hnsw"):
+            self.vector_store.index.hnsw.efSearch = HNSW_EF_SEARCH
 
         # Load BM25 index and documents from pickle file
         with open(BM25_INDEX_PATH, "rb") as f:
             bm25_data = pickle.load(f)
-            self.bm25 = bm25_data['bm25']
             self.bm25_docs = bm25_data['docs']  # List of document texts for BM25
+        if 'bm25_matrix' in bm25_data:
+            self.bm25_matrix = bm25_data['bm25_matrix']  # Sparse (n_docs x vocab) term weights
+            self.bm25_vocab = bm25_data['bm25_vocab']    # Term -> column index
+            self.bm25_idf = bm25_data['bm25_idf']        # IDF per column
+        else:
+            # Index built before the sparse format: convert the rank_bm25 object once
+            self.bm25_matrix, self.bm25_vocab, self.bm25_idf = self._bm25_matrix_from_okapi(bm25_data['bm25'])
+        # Tokenizer the index was built with; older indexes were built with split(" ")
+        self.bm25_token_re = bm25_data.get('bm25_token_re')
 
-        # Load Cross-Encoder model for semantic re-ranking
-        self.cross_encoder = CrossEncoder(CROSS_ENCODER_MODEL)
+        # Load Cross-Encoder model for semantic re-ranking:
+        # fp16 weights on GPU, fixed max sequence length so batch shapes stay stable
+        self.cross_encoder = CrossEncoder(
+            CROSS_ENCODER_MODEL,
+            device=device,
+            max_length=RERANK_MAX_LENGTH,
+            model_kwargs=fp16_kwargs
+        )
+        self.cross_encoder.model.eval()
+        if COMPILE_CROSS_ENCODER and device == "cuda":
+            self._compile_cross_encoder()
+
+        # Worker threads running the BM25 search while FAISS runs on the calling thread
+        self.search_executor = ThreadPoolExecutor(max_workers=BM25_MAX_WORKERS)
 
         print("Retriever loaded successfully.")
 
-    def search(self, query: str, k_retrieve: int = 50, k_rerank: int = 25, k_final: int = 5) -> str:
+    def _compile_cross_encoder(self):
+        """
+        Compile the Cross-Encoder with torch.compile and warm it up once, so the first
+        real query does not pay the compile cost.
+        Falls back to the eager model if compilation fails.
+        """
+        eager_model = self.cross_encoder.model
+        try:
+            # Default mode, no CUDA graphs: graphs are recorded per (batch, seq_len) shape
+            # and per calling thread, and predict runs from arbitrary asyncio.to_thread workers.
+            # Pairs are padded to the longest in each batch, so mark shapes dynamic
+            # rather than recompiling for every new sequence length
+            self.cross_encoder.model = torch.compile(eager_model, mode="default", dynamic=True)
+            self.cross_encoder.predict([["warm", "up"]], show_progress_bar=False)
+            print("Cross-Encoder compiled and warmed up.")
+        except Exception as e:
+            print(f"Cross-Encoder compilation failed, using eager mode: {e}")
+            self.cross_encoder.model = eager_model
+
+    @staticmethod
+    def _bm25_matrix_from_okapi(bm25):
+        """
+        Convert a pickled rank_bm25.BM25Okapi index into the sparse format
+        (term weight matrix, vocabulary, IDF) used by `_bm25_scores`.
+        """
+        vocab = {term: i for i, term in enumerate(bm25.idf)}
+        rows, cols, term_freqs = [], [], []
+        for doc_id, doc_freqs in enumerate(bm25.doc_freqs):
+            for term, tf in doc_freqs.items():
+                rows.append(doc_id)
+                cols.append(vocab[term])
+                term_freqs.append(tf)
+
+        rows = np.asarray(rows, dtype=np.int32)
+        term_freqs = np.asarray(term_freqs, dtype=np.float32)
+        doc_lens = np.asarray(bm25.doc_len, dtype=np.float32)
+        length_norm = bm25.k1 * (1 - bm25.b + bm25.b * doc_lens / bm25.avgdl)
+        weights = term_freqs * (bm25.k1 + 1) / (term_freqs + length_norm[rows])
+        matrix = csc_matrix((weights, (rows, cols)), shape=(len(doc_lens), len(vocab)), dtype=np.float32)
+        idf = np.fromiter(bm25.idf.values(), dtype=np.float32, count=len(vocab))
+        return matrix, vocab, idf
+
+    def _faiss_search(self, query: str, k: int) -> list:
+        """
+        Semantic search: embed the query exactly once, then search FAISS by vector.
+        """
+        query_embedding = self.embedding_model.embed_query(query)
+        return self.vector_store.similarity_search_with_score_by_vector(query_embedding, k=k)
+
+    def _tokenize(self, query: str) -> list[str]:
+        """
+        Tokenize the query exactly as build_index.py tokenized the BM25 corpus.
+        """
+        if self.bm25_token_re is None:
+            return query.split(" ")
+        return self.bm25_token_re.findall(query.lower())
+
+    def _bm25_scores(self, tokenized_query: list[str]) -> np.ndarray:
+        """
+        BM25 score of every document for the query, as one sparse mat-vec over
+        the columns of the query terms (repeated terms count once per occurrence).
+        """
+        query_freqs = [(self.bm25_vocab[token], count) for token, count in Counter(tokenized_query).items()
+                       if token in self.bm25_vocab]
+        if not query_freqs:
+            return np.zeros(self.bm25_matrix.shape[0], dtype=np.float32)
+        term_ids, counts = np.array(query_freqs, dtype=np.int64).T
+        return self.bm25_matrix[:, term_ids] @ (self.bm25_idf[term_ids] * counts.astype(np.float32))
+
+    def search_docs(self, query: str, k_retrieve: int = 50, k_rerank: int = 25, k_final: int = 5) -> list[str]:
         """
         Perform a hybrid semantic and keyword search with Reciprocal Rank Fusion (RRF),
-        followed by re-ranking using a Cross-Encoder, and return top-k final documents as context.
+        followed by re-ranking using a Cross-Encoder, and return the top-k final documents.
 
         Args:
             query (str): The input query string.
@@ -71,55 +180,103 @@ class AdvancedRetriever:
             k_final (int): Number of top documents to return as the final result.
 
         Returns:
-            str: Combined top document texts, separated by delimiters, as the retrieved context.
+            list[str]: Top document texts, best first.
         """
         print(f"[Retriever] Performing hybrid search with RRF for: '{query}'")
 
-        # --- 1. Retrieve candidates from FAISS vector store (semantic search) ---
-        faiss_results_with_scores = self.vector_store.similarity_search_with_score(query, k=k_retrieve)
-        # Map documents to their rank (1-based)
+        # --- 1 & 2. Run FAISS (semantic) and BM25 (keyword) searches concurrently ---
+        # Both spend their time in native code that releases the GIL, so the
+        # step takes max(faiss, bm25) instead of their sum. Only BM25 is handed off;
+        # FAISS runs on the calling thread, so concurrent requests never queue behind each other.
+        tokenized_query = self._tokenize(query)
+        bm25_future = self.search_executor.submit(self._bm25_scores, tokenized_query)
+        faiss_results_with_scores = self._faiss_search(query, k_retrieve)
+        bm25_scores = bm25_future.result()
+
+        # Map FAISS documents to their rank (1-based)
         faiss_ranked_results = {doc.page_content: i + 1 for i, (doc, score) in enumerate(faiss_results_with_scores)}
         print(f"[Retriever] FAISS found {len(faiss_ranked_results)} candidates.")
 
-        # --- 2. Retrieve candidates from BM25 (keyword-based) ---
-        tokenized_query = query.split(" ")
-        bm25_scores = self.bm25.get_scores(tokenized_query)
-        top_n_bm25_indices = np.argsort(bm25_scores)[::-1][:k_retrieve]
+        # Partial O(N) selection of the top k_retrieve, then sort only those
+        if k_retrieve < len(bm25_scores):
+            top_n_bm25_indices = np.argpartition(bm25_scores, -k_retrieve)[-k_retrieve:]
+        else:
+            top_n_bm25_indices = np.arange(len(bm25_scores))
+        top_n_bm25_indices = top_n_bm25_indices[np.argsort(bm25_scores[top_n_bm25_indices])[::-1]]
         # Map documents to their rank (1-based)
         bm25_ranked_results = {self.bm25_docs[idx]: i + 1 for i, idx in enumerate(top_n_bm25_indices)}
         print(f"[Retriever] BM25 found {len(bm25_ranked_results)} candidates.")
 
         # --- 3. Reciprocal Rank Fusion (RRF) to combine rankings ---
-        rrf_scores = defaultdict(float)
-        all_docs = set(faiss_ranked_results.keys()) | set(bm25_ranked_results.keys())
-
-        for doc in all_docs:
-            if doc in faiss_ranked_results:
-                rrf_scores[doc] += 1.0 / (RRF_K + faiss_ranked_results[doc])
-            if doc in bm25_ranked_results:
-                rrf_scores[doc] += 1.0 / (RRF_K + bm25_ranked_results[doc])
+        # Shared doc -> id map over the union of both candidate lists, then one
+        # dense RRF score array per method, summed element-wise
+        fused_docs = list(dict.fromkeys([*faiss_ranked_results, *bm25_ranked_results]))
+        doc_to_id = {doc: i for i, doc in enumerate(fused_docs)}
+        faiss_rrf = np.zeros(len(fused_docs))
+        bm25_rrf = np.zeros(len(fused_docs))
+        for ranked_results, rrf in ((faiss_ranked_results, faiss_rrf), (bm25_ranked_results, bm25_rrf)):
+            ids = np.fromiter((doc_to_id[doc] for doc in ranked_results), dtype=np.int64, count=len(ranked_results))
+            ranks = np.fromiter(ranked_results.values(), dtype=np.float64, count=len(ranked_results))
+            rrf[ids] = 1.0 / (RRF_K + ranks)
+        rrf_scores = faiss_rrf + bm25_rrf
+        print(f"[Retriever] RRF combined to {len(fused_docs)} unique candidates.")
 
-        # Sort documents by combined RRF score in descending order
-        reranked_by_rrf = sorted(rrf_scores.items(), key=lambda item: item[1], reverse=True)
-        print(f"[Retriever] RRF combined to {len(reranked_by_rrf)} unique candidates.")
-
-        # Select top candidates for cross-encoder re-ranking
-        candidates_for_rerank = [doc for doc, score in reranked_by_rrf[:k_rerank]]
+        # Select top candidates for cross-encoder re-ranking (partial selection, then sort those)
+        if k_rerank < len(rrf_scores):
+            top_rrf_ids = np.argpartition(rrf_scores, -k_rerank)[-k_rerank:]
+        else:
+            top_rrf_ids = np.arange(len(rrf_scores))
+        top_rrf_ids = top_rrf_ids[np.argsort(-rrf_scores[top_rrf_ids], kind="stable")]
+        candidates_for_rerank = [fused_docs[i] for i in top_rrf_ids]
 
         if not candidates_for_rerank:
-            return ""
+            return []
 
         # --- 4. Cross-Encoder re-ranking to refine top documents ---
         print(f"[Retriever] Re-ranking top {len(candidates_for_rerank)} RRF candidates with CrossEncoder...")
         pairs = [[query, doc] for doc in candidates_for_rerank]
-        scores = self.cross_encoder.predict(pairs, show_progress_bar=False)
+        # All pairs in a single forward pass
+        scores = self.cross_encoder.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
         final_ranked_docs = sorted(zip(scores, candidates_for_rerank), key=lambda x: x[0], reverse=True)
-        print(f"[Retriever] CrossEncoder re-ranking complete.")
+        print("[Retriever] CrossEncoder re-ranking complete.")
 
         # --- 5. Format and return the final top-k documents as context ---
         final_docs = [doc for score, doc in final_ranked_docs[:k_final]]
         print(f"[Retriever] Selected top {len(final_docs)} documents.")
 
-        context = "\n\n---\n\n".join(final_docs)
+        return final_docs
+
+    def search(self, query: str, k_retrieve: int = 50, k_rerank: int = 25, k_final: int = 5) -> str:
+        """
+        Run `search_docs` and join the documents into one context string for the LLM.
+
+        Args:
+            query (str): The input query string.
+            k_retrieve (int): Number of documents to fetch initially from each search method.
+            k_rerank (int): Number of top documents to re-rank with the Cross-Encoder.
+            k_final (int): Number of top documents to return as the final result.
+
+        Returns:
+            str: Combined top document texts, separated by delimiters, as the retrieved context.
+        """
+        return "\n\n---\n\n".join(
+            self.search_docs(query, k_retrieve=k_retrieve, k_rerank=k_rerank, k_final=k_final)
+        )
+
+    async def asearch(self, query: str, k_retrieve: int = 50, k_rerank: int = 25, k_final: int = 5) -> str:
+        """
+        Async wrapper around `search` that runs the CPU/GPU-bound retrieval in a worker
+        thread, so the event loop stays free (e.g. while an LLM call is in flight).
 
-        return context
+        Args:
+            query (str): The input query string.
+            k_retrieve (int): Number of documents to fetch initially from each search method.
+            k_rerank (int): Number of top documents to re-rank with the Cross-Encoder.
+            k_final (int): Number of top documents to return as the final result.
+
+        Returns:
+            str: The retrieved context, as returned by `search`.
+        """
+        return await asyncio.to_thread(
+            self.search, query, k_retrieve=k_retrieve, k_rerank=k_rerank, k_final=k_final
+        )
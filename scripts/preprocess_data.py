@@ -2,9 +2,18 @@
 # Imports
 # ============================================================
 
-import pandas as pd
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import repeat
+import hashlib
+import json
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import os
+import xxhash
 
 # ============================================================
 # Configuration
@@ -15,85 +24,403 @@ RAW_DATA_DIRS = [
     "data/raw/4_MPlus_Health_Topics_QA"
 ]
 
-# Output path for combined processed CSV
-PROCESSED_DATA_PATH = "data/processed/medsage_processed.csv"
+# Output path for combined processed Parquet file (read by rag_system/build_index.py)
+PROCESSED_DATA_PATH = "data/processed/medsage_processed.parquet"
+
+# Optional CSV copy of the same data, written only when MEDSAGE_WRITE_CSV=1
+PROCESSED_CSV_PATH = "data/processed/medsage_processed.csv"
+WRITE_CSV = os.environ.get("MEDSAGE_WRITE_CSV") == "1"
+
+# Optional copy hash-partitioned by focus topic, written only when MEDSAGE_PARTITION_OUTPUT=1:
+# NUM_PARTITIONS Parquet files plus a {focus: partition} manifest, so consumers
+# needing a subset of topics read only the matching files
+PARTITIONED_DATA_DIR = "data/processed/partitioned"
+PARTITION_MANIFEST_NAME = "focus_partitions.json"
+NUM_PARTITIONS = 16
+PARTITION_OUTPUT = os.environ.get("MEDSAGE_PARTITION_OUTPUT") == "1"
+
+# Output columns, in order
+OUTPUT_COLUMNS = ['focus', 'question', 'answer', 'semantic_types', 'synonyms']
+PARQUET_SCHEMA = pa.schema([(name, pa.string()) for name in OUTPUT_COLUMNS])
+
+# Low-cardinality columns stored dictionary-encoded in Parquet
+DICTIONARY_COLUMNS = ['focus', 'semantic_types', 'synonyms']
+
+# Per-row text columns whose surrounding whitespace is stripped (vectorized, per row group).
+# Per-file metadata is stripped once per file in the parser instead.
+STRIP_COLUMNS = ['question', 'answer']
+
+# Rows buffered per Parquet row group
+ROW_GROUP_SIZE = 1 << 16
+
+# Rows per batch in Arrow's CSV writer
+CSV_BATCH_SIZE = 1 << 16
+
+# Elements that trigger parse events; everything else is only built as part of their subtrees
+PARSE_TAGS = ('Focus', 'FocusAnnotations', 'QAPair')
+
+# Options of the per-process pull parser: no DTD entity expansion or network access,
+# no ID indexing, whitespace-only text nodes dropped
+PULL_PARSER_OPTIONS = dict(
+    events=('end',), tag=PARSE_TAGS, remove_blank_text=True, resolve_entities=False,
+    no_network=True, collect_ids=False, huge_tree=False
+)
+
+# Bytes fed to the parser per read
+READ_CHUNK_SIZE = 1 << 16
+
+# Kernel readahead hints for each XML file before it is read (POSIX only)
+FADVISE_AVAILABLE = hasattr(os, 'posix_fadvise')
+
+# Leading bytes checked before parsing: a file whose head (after an optional UTF-8
+# BOM and whitespace) does not start with '<' is reported and skipped unparsed
+XML_HEAD_SIZE = 64
+XML_HEAD_STRIP = b'\xef\xbb\xbf \t\r\n'
+
+# XPath expressions compiled once at import instead of per find/findall call.
+# text() selects strings directly (no Element wrappers); smart_strings=False returns
+# plain str without a back-reference to the tree.
+SEMANTIC_TYPE_XPATH = ET.XPath('.//SemanticType/text()', smart_strings=False)
+SYNONYM_XPATH = ET.XPath('.//Synonym/text()', smart_strings=False)
+QUESTION_XPATH = ET.XPath('./Question/text()', smart_strings=False)
+ANSWER_XPATH = ET.XPath('./Answer/text()', smart_strings=False)
+
+# Files handed to each worker process per task (amortizes pickling of small result lists)
+PARSE_CHUNK_SIZE = 32
+
+# Re-run skip: the output Parquet file records a hash of PARSER_VERSION, the output
+# options and (path, mtime, size) of every input XML file; a run whose hash matches
+# the existing output does nothing. Bump PARSER_VERSION whenever the parsing or
+# cleaning logic changes, so the next run rebuilds the output.
+PARSER_VERSION = 1
+INPUT_HASH_KEY = b"medsage_input_hash"
+
+# ============================================================
+# XML File Discovery
+# ============================================================
+
+def _iter_xml(data_dir: str):
+    """
+    Yield the paths of all .xml files under data_dir.
+    Uses an explicit stack over os.scandir: DirEntry type checks come from the
+    directory listing itself, so no extra stat call is made per entry.
+    """
+    stack = [data_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith('.xml') and entry.is_file(follow_symlinks=False):
+                    yield entry.path
+
+# ============================================================
+# Per-File Parsing (runs in worker processes)
+# ============================================================
+
+_xml_parser = None  # Reusable XMLPullParser of this process (see _init_worker)
+
+
+def _init_worker():
+    """
+    Process pool initializer: create the pull parser this worker reuses for every file.
+    """
+    global _xml_parser
+    _xml_parser = ET.XMLPullParser(**PULL_PARSER_OPTIONS)
+
+
+def _iter_parse_events(file_path: str):
+    """
+    Feed one XML file through the process's shared pull parser, yielding each
+    Focus / FocusAnnotations / QAPair element as its end tag is reached.
+    A file whose first bytes do not look like XML is reported and yields nothing
+    (checked on the first chunk, which is fed to the parser anyway, so no extra read).
+    On a syntax error the parser is reset for the next file and the error re-raised.
+    """
+    if _xml_parser is None:
+        _init_worker()
+    parser = _xml_parser
+    with open(file_path, 'rb') as f:
+        if FADVISE_AVAILABLE:
+            # Whole file is read front to back: widen readahead and start it right away
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk[:XML_HEAD_SIZE].lstrip(XML_HEAD_STRIP).startswith(b'<'):
+            print(f"Warning: Skipping {file_path}: not an XML document.")
+            return
+        try:
+            while chunk:
+                parser.feed(chunk)
+                for _, elem in parser.read_events():
+                    yield elem
+                chunk = f.read(READ_CHUNK_SIZE)
+            parser.close()
+            for _, elem in parser.read_events():
+                yield elem
+        except ET.XMLSyntaxError:
+            for _ in parser.read_events():
+                pass
+            try:
+                parser.close()
+            except ET.XMLSyntaxError:
+                pass
+            raise
+
+def _parse_one(file_path: str) -> tuple[dict[str, str], list[str], list[str]]:
+    """
+    Parse one MedQuAD XML file and extract its question-answer pairs along with
+    the file's metadata (focus topic, semantic types, synonyms).
+
+    Args:
+        file_path: Path to the XML file.
+
+    Returns:
+        (metadata, questions, answers): the per-file constants (focus, semantic_types,
+        synonyms) and the question/answer texts of every complete QA pair
+        (no pairs if the file cannot be parsed).
+    """
+    focus_text = ""
+    semantic_types_str = ""
+    synonyms_str = ""
+    focus_found = annotations_found = False
+    questions, answers = [], []
+    try:
+        # Stream the document: only Focus, FocusAnnotations and QAPair end events fire,
+        # and each consumed QAPair is freed so memory stays at about one QAPair
+        for elem in _iter_parse_events(file_path):
+            if elem.tag == 'QAPair':
+                # Collect only complete QA pairs (non-empty)
+                question = QUESTION_XPATH(elem)
+                answer = ANSWER_XPATH(elem)
+                if question and answer:
+                    questions.append(question[0])
+                    answers.append(answer[0])
+                # Free the consumed QAPair and the already-processed siblings before it
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+            elif elem.tag == 'Focus':
+                # Main topic or focus: the <Focus> tag directly under the document root
+                if not focus_found and elem.getparent().getparent() is None:
+                    focus_found = True
+                    focus_text = elem.text.strip() if elem.text else ""
+            elif not annotations_found:
+                # Semantic types and synonyms from the first <FocusAnnotations>
+                annotations_found = True
+                semantic_types_str = "|".join(value for text in SEMANTIC_TYPE_XPATH(elem) if (value := text.strip()))
+                synonyms_str = "|".join(value for text in SYNONYM_XPATH(elem) if (value := text.strip()))
+
+    except ET.XMLSyntaxError as e:
+        # Only well-formedness errors land here (non-XML files are filtered before parsing)
+        print(f"Warning: Could not parse {file_path}: {e}")
+        questions, answers = [], []
+
+    # Metadata is returned once per file rather than per pair, so values that
+    # appear after the QAPairs still apply to all of them
+    metadata = {'focus': focus_text, 'semantic_types': semantic_types_str, 'synonyms': synonyms_str}
+    return metadata, questions, answers
+
+# ============================================================
+# Re-run Skip
+# ============================================================
+
+def _input_hash(xml_files: dict[str, list[str]]) -> str:
+    """
+    Hash of everything the output depends on: PARSER_VERSION, the output options
+    and the path, mtime and size of every input XML file.
+
+    Args:
+        xml_files: {data directory: XML file paths found under it}.
+    """
+    digest = hashlib.sha1(f"{PARSER_VERSION}|{WRITE_CSV}|{PARTITION_OUTPUT}".encode())
+    # Stats run serially here, not in the worker pool: the skip is decided before the
+    # pool is started, and a few thousand local stats take milliseconds
+    for file_paths in xml_files.values():
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            digest.update(f"\n{file_path}|{stat.st_mtime_ns}|{stat.st_size}".encode())
+    return digest.hexdigest()
+
+
+def _output_is_current(input_hash: str) -> bool:
+    """
+    True if all enabled outputs exist and the Parquet file was written from the
+    same inputs (its stored input hash matches).
+    """
+    expected = [PROCESSED_DATA_PATH]
+    if WRITE_CSV:
+        expected.append(PROCESSED_CSV_PATH)
+    if PARTITION_OUTPUT:
+        expected.append(os.path.join(PARTITIONED_DATA_DIR, PARTITION_MANIFEST_NAME))
+    if not all(os.path.exists(path) for path in expected):
+        return False
+    try:
+        stored = pq.read_metadata(PROCESSED_DATA_PATH).metadata or {}
+    except pa.ArrowInvalid:
+        # Truncated or otherwise unreadable output
+        return False
+    return stored.get(INPUT_HASH_KEY) == input_hash.encode()
+
+# ============================================================
+# Partitioned Output
+# ============================================================
+
+class PartitionedWriter:
+    def __init__(self, out_dir: str, num_partitions: int = NUM_PARTITIONS):
+        """
+        Writes rows into num_partitions Parquet files, choosing the file by
+        xxh32(focus) % num_partitions so every row of a topic lands in the same file.
+
+        Args:
+            out_dir: Directory for the part-XX.parquet files and the focus manifest.
+            num_partitions: Number of partition files.
+        """
+        self.out_dir = out_dir
+        self.num_partitions = num_partitions
+        self.writers = {}           # Partition -> open ParquetWriter (created on first row)
+        self.focus_partitions = {}  # Focus -> partition (also saved as the manifest)
+
+        # Drop part files from an earlier run so a partition left empty this time is not stale
+        with os.scandir(out_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith("part-") and entry.name.endswith(".parquet"):
+                    os.remove(entry.path)
+
+    def _partition(self, focus: str) -> int:
+        partition = self.focus_partitions.get(focus)
+        if partition is None:
+            partition = xxhash.xxh32_intdigest(focus.encode()) % self.num_partitions
+            self.focus_partitions[focus] = partition
+        return partition
+
+    def write_table(self, table: pa.Table):
+        """
+        Split a row group by partition and append each part to its file.
+        """
+        partitions = pa.array([self._partition(focus) for focus in table['focus'].to_pylist()], type=pa.int32())
+        for partition in pc.unique(partitions).to_pylist():
+            writer = self.writers.get(partition)
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    os.path.join(self.out_dir, f"part-{partition:02d}.parquet"), PARQUET_SCHEMA,
+                    compression='zstd', use_dictionary=DICTIONARY_COLUMNS
+                )
+                self.writers[partition] = writer
+            writer.write_table(table.filter(pc.equal(partitions, partition)))
+
+    def close(self):
+        """
+        Close all partition files and save the {focus: partition} manifest.
+        """
+        for writer in self.writers.values():
+            writer.close()
+        with open(os.path.join(self.out_dir, PARTITION_MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(self.focus_partitions, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 # ============================================================
 # Main Preprocessing Function
 # ============================================================
 
+def _write_row_group(writer: pq.ParquetWriter, columns: dict[str, list], extra_writers: list):
+    """
+    Write the buffered column lists as one Parquet row group (and to the CSV and
+    partitioned copies, if enabled), then empty them. Whitespace is stripped here over whole columns
+    rather than per value in the parse loop.
+    """
+    table = pa.table(columns, schema=PARQUET_SCHEMA)
+    for name in STRIP_COLUMNS:
+        table = table.set_column(table.schema.get_field_index(name), name, pc.utf8_trim_whitespace(table[name]))
+    writer.write_table(table)
+    for extra_writer in extra_writers:
+        extra_writer.write_table(table)
+    for values in columns.values():
+        values.clear()
+
+
 def preprocess_medquad_xml_recursive():
     """
     Recursively searches for all XML files in the specified data directories,
     extracts question-answer pairs along with associated metadata (focus topic,
-    semantic types, synonyms), and combines all data into a single CSV file.
+    semantic types, synonyms) using a pool of worker processes, and writes all
+    rows to a single ZSTD-compressed Parquet file (plus a CSV copy if MEDSAGE_WRITE_CSV=1).
+    Does nothing if the existing output was built from the same inputs and PARSER_VERSION.
     """
-    all_rows = []
+    n_rows = 0
+    columns = {name: [] for name in OUTPUT_COLUMNS}  # Rows buffered for the next row group
+    string_cache = {}  # Interned focus / semantic_types / synonyms values across all files
 
-    # Traverse all directories in RAW_DATA_DIRS
+    # Find all XML files up front (in RAW_DATA_DIRS order) so the inputs can be hashed
+    xml_files = {}
     for data_dir in RAW_DATA_DIRS:
         if not os.path.exists(data_dir):
             print(f"Warning: Data directory not found at {data_dir}. Skipping.")
             continue
-
         print(f"Searching for XML files in '{data_dir}'...")
+        xml_files[data_dir] = list(_iter_xml(data_dir))
 
-        # Recursively walk directory to find XML files
-        for root, _, files in os.walk(data_dir):
-            for file in files:
-                if file.endswith('.xml'):
-                    file_path = os.path.join(root, file)
-                    try:
-                        tree = ET.parse(file_path)
-                        xml_root = tree.getroot()
-
-                        # Extract main topic or focus from <Focus> tag
-                        focus_element = xml_root.find('Focus')
-                        focus_text = focus_element.text.strip() if focus_element is not None and focus_element.text else ""
-
-                        # Extract semantic types and synonyms from <FocusAnnotations>, if available
-                        focus_annotations = xml_root.find('.//FocusAnnotations')
-                        semantic_types = []
-                        synonyms = []
-                        if focus_annotations is not None:
-                            semantic_types = [st.text for st in focus_annotations.findall('.//SemanticType')]
-                            synonyms = [s.text for s in focus_annotations.findall('.//Synonym')]
-
-                        semantic_types_str = "|".join(filter(None, semantic_types))
-                        synonyms_str = "|".join(filter(None, synonyms))
-
-                        # Extract all QAPair entries with their questions and answers
-                        for qa_pair in xml_root.findall('.//QAPair'):
-                            question_element = qa_pair.find('Question')
-                            answer_element = qa_pair.find('Answer')
-
-                            if question_element is not None and answer_element is not None:
-                                question = question_element.text
-                                answer = answer_element.text
-
-                                # Collect only complete QA pairs (non-empty)
-                                if question and answer:
-                                    all_rows.append({
-                                        'focus': focus_text,
-                                        'question': question.strip(),
-                                        'answer': answer.strip(),
-                                        'semantic_types': semantic_types_str,
-                                        'synonyms': synonyms_str
-                                    })
-
-                    except ET.ParseError:
-                        print(f"Warning: Could not parse {file_path}.")
-
-    # Convert the list of dicts to a DataFrame
-    print(f"\nExtracted a total of {len(all_rows)} question-answer pairs.")
-    df = pd.DataFrame(all_rows)
+    input_hash = _input_hash(xml_files)
+    if _output_is_current(input_hash):
+        print(f"{PROCESSED_DATA_PATH} is up to date with the XML inputs "
+              f"(parser version {PARSER_VERSION}). Nothing to do.")
+        return
 
     # Ensure output directory exists
     os.makedirs("data/processed", exist_ok=True)
 
-    # Save combined data to CSV
-    print(f"Saving combined processed data to {PROCESSED_DATA_PATH}")
-    df.to_csv(PROCESSED_DATA_PATH, index=False)
+    print(f"Writing combined processed data to {PROCESSED_DATA_PATH}")
+    with ExitStack() as stack:
+        parquet_writer = stack.enter_context(pq.ParquetWriter(
+            PROCESSED_DATA_PATH, PARQUET_SCHEMA, compression='zstd', use_dictionary=DICTIONARY_COLUMNS
+        ))
+
+        # Optional copies, fed the same row groups as the main Parquet file
+        extra_writers = []
+        if WRITE_CSV:
+            # Arrow's C++ CSV writer
+            print(f"Writing CSV copy to {PROCESSED_CSV_PATH}")
+            extra_writers.append(stack.enter_context(pacsv.CSVWriter(
+                PROCESSED_CSV_PATH, PARQUET_SCHEMA,
+                write_options=pacsv.WriteOptions(include_header=True, batch_size=CSV_BATCH_SIZE)
+            )))
+        if PARTITION_OUTPUT:
+            print(f"Writing {NUM_PARTITIONS} focus-partitioned Parquet files to {PARTITIONED_DATA_DIR}")
+            os.makedirs(PARTITIONED_DATA_DIR, exist_ok=True)
+            extra_writers.append(stack.enter_context(PartitionedWriter(PARTITIONED_DATA_DIR)))
+
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker) as executor:
+            # One directory at a time, so output order follows RAW_DATA_DIRS;
+            # map() yields results in input order
+            for file_paths in xml_files.values():
+                for metadata, questions, answers in executor.map(
+                    _parse_one, file_paths, chunksize=PARSE_CHUNK_SIZE
+                ):
+                    n_pairs = len(questions)
+                    columns['question'].extend(questions)
+                    columns['answer'].extend(answers)
+                    # Per-file constants: one shared (interned) str object, repeated for each pair
+                    for name, value in metadata.items():
+                        columns[name].extend(repeat(string_cache.setdefault(value, value), n_pairs))
+                    n_rows += n_pairs
+
+                    if len(columns['focus']) >= ROW_GROUP_SIZE:
+                        _write_row_group(parquet_writer, columns, extra_writers)
+
+        if columns['focus']:
+            _write_row_group(parquet_writer, columns, extra_writers)
+
+        # Stamp the input hash only after every row was written, so an interrupted
+        # run never leaves an output that looks current
+        parquet_writer.add_key_value_metadata({INPUT_HASH_KEY: input_hash.encode()})
+
+    print(f"\nExtracted a total of {n_rows} question-answer pairs "
+          f"from {sum(map(len, xml_files.values()))} files.")
     print("Preprocessing complete.")
 
 # ============================================================